@@ -0,0 +1,297 @@
+'''
+End to end benchmark of the report pipeline
+
+Builds a synthetic workout.db with `--users` users and `--years` of
+one_rep_max history each, then times every stage of `WorkoutMaker.run`
+separately and `workout_maker.main` as a whole. Each repeat starts from
+a fresh copy of the db, so `progress_one_rep_max` always has
+`--lag` months to catch up. Peak memory is measured with tracemalloc
+in an extra run of `main`, so it does not skew the timings.
+
+Results are written as json - pass an earlier result to `--compare` to
+print the change per stage. Exits with status 1 if a stage got slower
+by more than `--max-regression` percent.
+
+Usage
+-----
+python benchmarks/bench_pipeline.py --users 200 --years 3 --json bench.json
+python benchmarks/bench_pipeline.py --users 200 --years 3 --compare bench.json
+'''
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the steps of `WorkoutMaker.run`, in the order it takes them
+stages = ['progress_one_rep_max', 'create_workout_df', 'create_chart_html', 'save_report']
+
+accessories = {'deadlift': ['Rows', 'Pullups', 'Curls', 'Back Extension'],
+               'squat': ['Lunges', 'Leg Press', 'Calf Raise', 'Hanging Leg Raise'],
+               'bench': ['Dips', 'Dumbbell Press', 'Flys', 'Tricep Extension'],
+               'ohp': ['Lateral Raise', 'Face Pull', 'Shrugs', 'Push Press']}
+
+
+def build_db(path, users=100, years=2, lag=1, seed=0):
+    '''
+    Builds a synthetic workout db
+
+    Parameters
+    ----------
+    path: str
+    users: int
+    years: int
+        years of one_rep_max history per user
+    lag: int
+        months between the latest one_rep_max entry and today
+    seed: int
+
+    Notes
+    -----
+    Must be called from the benchmark's working directory - the
+    repo modules are imported relative to it
+    '''
+    import numpy as np
+    import pandas as pd
+
+    from functions.db_funcs import create_db
+    from functions.dt_funcs import new_month, now
+    from functions.json_funcs import encode
+
+    rng = np.random.default_rng(seed)
+    con = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+    create_db(con)
+
+    user_ids = np.arange(1, users + 1)
+    publish_time = str(now(date=False))
+    dim_user = pd.DataFrame({'user_id': user_ids,
+                             'user_name': [f'user{i}' for i in user_ids],
+                             'email': [f'user{i}@example.com' for i in user_ids]})
+    pause = pd.DataFrame({'user_id': user_ids, 'pause_flag': 'False'})
+    prog = pd.DataFrame({'user_id': user_ids,
+                         'prog_dict': [encode({'squat': 5.0, 'deadlift': 5.0,
+                                               'bench': 2.5, 'ohp': 2.5})] * users})
+
+    anchor = new_month(timeskip='back')[0]
+    months = years * 13
+    offsets = pd.to_timedelta((np.arange(months)[::-1] + lag) * 28, unit='D')
+    starts = anchor - offsets
+    base = rng.uniform(0.6, 1.4, size=(users, 1)) * np.array([[225, 185, 155, 95]])
+    orm = []
+    for i, user_id in enumerate(user_ids):
+        weights = base[i] + np.arange(months)[:, None] * np.array([5, 5, 2.5, 2.5])
+        weights = np.round(weights / 2.5) * 2.5
+        orm.append(pd.DataFrame({
+            'user_id': user_id,
+            'data_start_date': starts,
+            'data_end_date': starts + pd.Timedelta(days=27),
+            'orm_dict': [encode(dict(zip(['deadlift', 'squat', 'bench', 'ohp'], row.tolist())))
+                         for row in weights],
+            'publish_time': publish_time}))
+    orm = pd.concat(orm, ignore_index=True)
+
+    acc = pd.DataFrame([(me, ae, float(rng.integers(0, 40) * 5), 4, 10)
+                        for me in accessories for ae in accessories[me]],
+                       columns=['me_name', 'ae_name', 'ae_weight', 'sets', 'reps'])
+    acc = pd.concat([acc.assign(user_id=user_id) for user_id in user_ids], ignore_index=True)
+    acc['publish_time'] = publish_time
+
+    with con:
+        for table, df in [('dim_user', dim_user), ('pause_workout', pause),
+                          ('dim_progression', prog), ('one_rep_max', orm),
+                          ('accessory', acc)]:
+            df.to_sql(table, con, if_exists='append', index=False)
+    con.close()
+
+
+def fresh_copy(template, db='workout.db'):
+    '''
+    Replaces the working db with a copy of the template
+    '''
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(db + suffix):
+            os.remove(db + suffix)
+    shutil.copy(template, db)
+
+
+def time_stages(db='workout.db'):
+    '''
+    Runs the pipeline stage by stage for every active user
+
+    Returns
+    -------
+    timings: obj, dict
+        total seconds per stage
+    users: int
+    '''
+    from functions.db_funcs import get_db_con, load_context
+    import workout_maker as wm
+
+    con = get_db_con(db)
+    kwarg_iter = wm.get_iterable_kwargs(con)
+    context = load_context(con)
+    timings = dict.fromkeys(stages, 0.0)
+
+    def timed(stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        timings[stage] += time.perf_counter() - start
+        return result
+
+    for kwargs in kwarg_iter:
+        kwargs['con'] = con
+        runner = wm.WorkoutMaker(**kwargs, context=context)
+        timed('progress_one_rep_max', runner.progress_one_rep_max)
+        timed('create_workout_df', runner.create_workout_df)
+        chart_html = timed('create_chart_html', runner.create_chart_html)
+        timed('save_report', runner.save_report, f'{runner.user}-bench.html', chart_html)
+    con.close()
+    return timings, len(kwarg_iter)
+
+
+def time_main(db='workout.db', workers=None, trace=False):
+    '''
+    Runs `workout_maker.main`
+
+    Returns
+    -------
+    seconds: float
+    peak_mb: float
+        tracemalloc peak, None unless `trace` is True
+    '''
+    from functions.db_funcs import get_db_con
+    import workout_maker as wm
+
+    con = get_db_con(db)
+    if trace == True:
+        tracemalloc.start()
+    start = time.perf_counter()
+    wm.main(con, workers=workers, db=db)
+    seconds = time.perf_counter() - start
+    peak_mb = None
+    if trace == True:
+        peak_mb = round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 1)
+        tracemalloc.stop()
+    con.close()
+    return seconds, peak_mb
+
+
+def main(users=100, years=2, lag=1, repeat=3, workers=None, seed=0):
+    '''
+    Runs the benchmark in a temporary directory
+
+    Returns
+    -------
+    result: obj, dict
+    '''
+    cwd = os.getcwd()
+    sys.path.insert(0, REPO_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        # the repo modules open workout.db and workout.log relative to the
+        # working directory on import, so nothing is imported before this
+        os.chdir(tmp)
+        try:
+            import numpy as np
+            import pandas as pd
+
+            from functions.log_funcs import configure_logging
+            configure_logging(level=logging.WARNING)
+
+            # WorkoutMaker prints a greeting per user - keep stdout for the result
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                build_start = time.perf_counter()
+                build_db('template.db', users, years, lag, seed)
+                build_seconds = time.perf_counter() - build_start
+
+                stage_runs, main_runs = [], []
+                for _ in range(repeat):
+                    fresh_copy('template.db')
+                    stage_runs.append(time_stages()[0])
+                    fresh_copy('template.db')
+                    main_runs.append(time_main(workers=workers)[0])
+                fresh_copy('template.db')
+                peak_mb = time_main(workers=workers, trace=True)[1]
+        finally:
+            os.chdir(cwd)
+
+    stage_result = {}
+    for stage in stages:
+        seconds = statistics.median(run[stage] for run in stage_runs)
+        stage_result[stage] = {'seconds': round(seconds, 4),
+                               'ms_per_user': round(seconds / users * 1000, 3)}
+    main_seconds = statistics.median(main_runs)
+    return {'config': {'users': users, 'years': years, 'lag': lag, 'repeat': repeat,
+                       'workers': workers, 'seed': seed},
+            'env': {'python': platform.python_version(), 'numpy': np.__version__,
+                    'pandas': pd.__version__, 'platform': platform.platform()},
+            'build_seconds': round(build_seconds, 3),
+            'stages': stage_result,
+            'main': {'seconds': round(main_seconds, 4),
+                     'users_per_sec': round(users / main_seconds, 2),
+                     'peak_memory_mb': peak_mb}}
+
+
+def compare(result, baseline, max_regression=None):
+    '''
+    Prints the change of each stage against an earlier result
+
+    Returns
+    -------
+    ok: bool
+        False if any stage slowed down by more than `max_regression` percent
+    '''
+    config = {key: val for key, val in result['config'].items() if key != 'repeat'}
+    base_config = {key: val for key, val in baseline['config'].items() if key != 'repeat'}
+    if config != base_config:
+        print(f'warning - configs differ: {base_config} vs {config}')
+    rows = [(stage, baseline['stages'][stage]['ms_per_user'], result['stages'][stage]['ms_per_user'])
+            for stage in stages if stage in baseline['stages']]
+    rows.append(('main', 1000 / baseline['main']['users_per_sec'],
+                 1000 / result['main']['users_per_sec']))
+    ok = True
+    print(f'{"stage":<22}{"before ms/user":>16}{"after ms/user":>16}{"change":>10}')
+    for stage, before, after in rows:
+        change = (after - before) / before * 100 if before > 0 else 0.0
+        print(f'{stage:<22}{before:>16.3f}{after:>16.3f}{change:>9.1f}%')
+        if max_regression is not None and change > max_regression:
+            ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--lag', type=int, default=1,
+                        help='months of one_rep_max for progress_one_rep_max to catch up')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='time main with a process pool of this size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='write the result to this file')
+    parser.add_argument('--compare', default=None, help='earlier result to compare against')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='fail if a stage is this many percent slower than --compare')
+    args = parser.parse_args()
+
+    result = main(args.users, args.years, args.lag, args.repeat, args.workers, args.seed)
+    print(json.dumps(result, indent=2))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    ok = True
+    if args.compare is not None:
+        with open(args.compare) as f:
+            ok = compare(result, json.load(f), args.max_regression)
+    sys.exit(0 if ok else 1)
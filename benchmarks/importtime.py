@@ -0,0 +1,118 @@
+'''
+Cold start benchmark for the cron entry point
+
+Imports `workout_maker` in a fresh interpreter with `python -X importtime`
+and reports the total import time and the slowest top-level imports.
+Exits with status 1 if a module that should be imported lazily shows up,
+or if the median total exceeds `--max-ms`.
+
+Usage
+-----
+python benchmarks/importtime.py --repeat 5 --max-ms 800 --json importtime.json
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+lazy_modules = ['plotly', 'pytz']
+
+
+def parse_importtime(stderr):
+    '''
+    Parses `-X importtime` output
+
+    Parameters
+    ----------
+    stderr: str
+
+    Returns
+    -------
+    imports: list of tuple
+        (module, self_us, cumulative_us, depth) for each import
+    '''
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def time_import(module):
+    '''
+    Imports `module` in a fresh interpreter
+
+    Parameters
+    ----------
+    module: str
+
+    Returns
+    -------
+    imports: list of tuple
+        output of `parse_importtime`
+
+    Notes
+    -----
+    Runs from a temporary directory so the module level
+    connection does not touch the repo's workout.db
+    '''
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                              cwd=tmp, env=env, capture_output=True, text=True, check=True)
+    return parse_importtime(proc.stderr)
+
+
+def main(module='workout_maker', repeat=5, max_ms=None, top=10):
+    '''
+    Runs the benchmark
+
+    Returns
+    -------
+    result: obj, dict
+    ok: bool
+        False if a lazy module was imported or `max_ms` was exceeded
+    '''
+    runs = [time_import(module) for _ in range(repeat)]
+    totals = [sum(imp[1] for imp in run) / 1000 for run in runs]
+    last = runs[-1]
+    imported = {imp[0] for imp in last}
+    eager = [mod for mod in lazy_modules if mod in imported]
+    top_level = sorted([imp for imp in last if imp[3] <= 1],
+                       key=lambda imp: imp[2], reverse=True)[:top]
+    result = {'module': module,
+              'repeat': repeat,
+              'total_ms_median': round(statistics.median(totals), 1),
+              'total_ms_min': round(min(totals), 1),
+              'eager_lazy_modules': eager,
+              'slowest_imports_ms': {imp[0]: round(imp[2] / 1000, 1) for imp in top_level}}
+    ok = len(eager) == 0
+    if max_ms is not None and result['total_ms_median'] > max_ms:
+        ok = False
+    return result, ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--module', default='workout_maker')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='fail if the median total import time is above this')
+    parser.add_argument('--json', default=None, help='write the result to this file')
+    args = parser.parse_args()
+
+    result, ok = main(args.module, args.repeat, args.max_ms)
+    print(json.dumps(result, indent=2))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    sys.exit(0 if ok else 1)
@@ -1,51 +1,40 @@
 '''functions for retrieving and updating various database fields'''
 
-import ast
 import datetime
-import json
-import logging
+import queue
 import sqlite3
-import sys
-from logging import Formatter, StreamHandler
-from logging.handlers import RotatingFileHandler
+import threading
+from contextlib import contextmanager
 
 import numpy as np
 import os
 import pandas as pd
 
-from functions.dt_funcs import (buffer_week, get_dates, get_latest, get_month,
-                                get_week, new_month, now)
+from functions.dt_funcs import (buffer_week, get_latest, get_month, new_month, now,
+                                resolve_dates, timeline_version)
+from functions.json_funcs import decode, encode
+from functions.log_funcs import configure_logging, get_logger
+from functions.metrics_funcs import instrument, metrics, timed
+from functions.plan_funcs import plan_keys, plan_rows
+from functions.record_funcs import (AccessoryLift, OrmEntry, PlanRow, ProgressionEntry,
+                                    records_to_frame, table_rows)
+from functions.schema_funcs import migrate
 
 LOCAL_DIR = 'C:/Users/Matt/Dropbox/lp-workout/'
 if os.path.isdir(LOCAL_DIR) == False:
     LOCAL_DIR = '.'
 
 
-def get_logger():
-    '''
-    Returns
-    -------
-    logger: module
-        custom logging module with stream
-        and file handler
-    '''
-    logger = logging.getLogger('workout_logger')
-    formatter = Formatter('%(asctime)s | %(levelname)s | %(message)s')
-    sh = StreamHandler(stream=sys.stdout)
-    sh.setFormatter(formatter)
-    fh = RotatingFileHandler(
-        os.path.join(LOCAL_DIR, 'workout.log'), maxBytes=10*1024*1024, backupCount=0)
-    fh.setFormatter(formatter)
-    logger.addHandler(sh)
-    logger.addHandler(fh)
-    logger.setLevel(logging.INFO)
-    return logger
+configure_logging(LOCAL_DIR)
+logger = get_logger('db')
 
 
-logger = get_logger()
+sqlite3.register_adapter(np.int64, lambda x: int(x))
+sqlite3.register_adapter(pd.Timestamp, lambda x: str(x))
 
 
-def get_db_con(db='workout.db'):
+def get_db_con(db='workout.db', wal=True, timeout=30, mmap_size=256*1024*1024,
+               cache_size=-64*1024, check_same_thread=True, trace=True):
     '''
     gets sqlite database connection with necessary adapters
 
@@ -53,21 +42,113 @@ def get_db_con(db='workout.db'):
     ----------
     db: str
         sqlite database name
+    wal: bool
+        True to use write-ahead logging with synchronous=NORMAL,
+        so readers never block on the writer
+    timeout: float
+        seconds to wait on a locked database before raising
+    mmap_size: int
+        bytes of the database file to memory map
+    cache_size: int
+        page cache size - negative values are in KiB
+    check_same_thread: bool
+        False to allow the connection to be used from
+        threads other than the one that opened it
+    trace: bool
+        True to count the statements run on the connection
+        in `functions.metrics_funcs.metrics`
 
     Returns
     -------
     con: sqlite3.Connection
     '''
     db_path = os.path.join(LOCAL_DIR, db)
-    sqlite3.register_adapter(np.int64, lambda x: int(x))
-    sqlite3.register_adapter(pd.Timestamp, lambda x: str(x))
-    con = sqlite3.connect(db, detect_types=sqlite3.PARSE_DECLTYPES)
+    con = sqlite3.connect(db, detect_types=sqlite3.PARSE_DECLTYPES,
+                          timeout=timeout, check_same_thread=check_same_thread)
+    if wal == True:
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('PRAGMA synchronous=NORMAL')
+    con.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+    con.execute(f'PRAGMA cache_size={int(cache_size)}')
+    if trace == True:
+        instrument(con)
     return con
 
 
+class ConnectionPool(object):
+    '''
+    Pool of read connections plus a single writer connection
+    that can be checked out from multiple threads
+
+    Parameters
+    ----------
+    db: str
+        sqlite database name
+    readers: int
+        number of read connections
+    **kwargs
+        passed on to `get_db_con`
+
+    Examples
+    --------
+    >>> pool = ConnectionPool('workout.db')
+    >>> with pool.reader() as con:
+    ...     dim_user = pd.read_sql('SELECT * FROM dim_user', con)
+    >>> with pool.writer() as con:
+    ...     create_db(con)
+    '''
+
+    def __init__(self, db='workout.db', readers=4, **kwargs):
+        kwargs['check_same_thread'] = False
+        self._readers = queue.Queue()
+        for _ in range(readers):
+            con = get_db_con(db, **kwargs)
+            con.execute('PRAGMA query_only=ON')
+            self._readers.put(con)
+        self._writer = get_db_con(db, **kwargs)
+        self._write_lock = threading.Lock()
+
+    @contextmanager
+    def reader(self, timeout=None):
+        '''
+        Checks out a read connection, waiting up to `timeout`
+        seconds for one to be returned if all are in use
+        '''
+        con = self._readers.get(timeout=timeout)
+        try:
+            yield con
+        finally:
+            self._readers.put(con)
+
+    @contextmanager
+    def writer(self):
+        '''
+        Checks out the writer connection - commits on exit,
+        or rolls back if an exception is raised
+        '''
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def close(self):
+        '''
+        Closes every connection in the pool
+        '''
+        with self._write_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get().close()
+
+
 def create_db(con):
     '''
-    Creates database tables if they do not exist
+    Creates database tables if they do not exist, migrates them
+    to the latest schema version and plans any month missing
+    from workout_plan
 
     Parameters
     ----------
@@ -82,6 +163,62 @@ def create_db(con):
         cur.execute("CREATE TABLE IF NOT EXISTS one_rep_max(user_id INT, data_start_date TIMESTAMP, data_end_date TIMESTAMP, orm_dict JSON, publish_time TIMESTAMP)")
         cur.execute("CREATE TABLE IF NOT EXISTS accessory(user_id INT, me_name STRING, ae_name STRING, ae_weight FLOAT, sets INT, reps INT, publish_time TIMESTAMP)")
         cur.execute("CREATE TABLE IF NOT EXISTS pause_workout(user_id INT, pause_date TIMESTAMP DEFAULT '2999-12-31 23:59:59', pause_flag BOOLEAN DEFAULT False)")
+    migrate(con)
+    fill_plans(con)
+
+
+def fill_plans(con):
+    '''
+    Plans every one_rep_max month without workout_plan rows,
+    e.g. the months stored before workout_plan was added
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+
+    Notes
+    -----
+    A month that can't be planned, e.g. one with a malformed orm_dict,
+    is logged and left for `DBHelper.get_plan` to retry
+    '''
+    entries = [OrmEntry(*row) for row in con.execute('''
+    SELECT o.user_id, CAST(o.data_start_date AS TEXT), o.data_end_date, o.orm_dict, o.publish_time
+    FROM one_rep_max o
+    WHERE NOT EXISTS
+    (SELECT 1 FROM workout_plan p
+    WHERE p.user_id = o.user_id AND p.data_start_date = o.data_start_date)''')]
+    try:
+        rows = plan_rows(entries)
+    except Exception:
+        rows = []
+        for entry in entries:
+            try:
+                rows += plan_rows([entry])
+            except Exception as e:
+                logger.warning('could not plan the month of user_id %s starting %s - %s',
+                               entry.user_id, entry.data_start_date, e)
+    if len(rows) > 0:
+        table_overwrite('workout_plan', rows, plan_keys, con)
+
+
+def read_sql(s, con, params=None):
+    '''
+    `pd.read_sql` that counts the rows read towards
+    the current user's metrics
+
+    Parameters
+    ----------
+    s: str
+    con: sqlite3.Connection
+    params: list, optional
+
+    Returns
+    -------
+    obj, pandas df
+    '''
+    df = pd.read_sql(s, con, params=params)
+    metrics.add('rows_read', df.shape[0])
+    return df
 
 
 def table_pull(con, user_id, table):
@@ -100,7 +237,7 @@ def table_pull(con, user_id, table):
     {table}
     WHERE user_id = ?
     '''
-    table = pd.read_sql(s, con, params=[user_id])
+    table = read_sql(s, con, params=[user_id])
     return table
 
 
@@ -127,65 +264,76 @@ def table_update(con, user_id, table, var, val):
         cur.execute(s, params=[val, user_id])
 
 
-def delete_params(df_slice):
+def unique_key_exists(con, table, keys):
     '''
-    Returns sql arguments for table_overwrite
-    function
+    Checks if a table has a primary key or unique index
+    on exactly the columns in `keys`
 
     Parameters
     ----------
-    df_slice: obj, pandas df
-        one row dataframes containing columns that match
-        the primary keys of a database table
+    con: sqlite3.Connection
+    table: str
+    keys: list of str
 
     Returns
     -------
-    arg: str
-        WHERE argument to pass df_slice values
-        into a DELETE sql query to 
-    params: list
-        list of params corresponding to df_slice values
-        to delete from table if there is a match
-
-    Raises
-    ------
-    AssertionError
-        If df_slice is not one row
+    bool
     '''
-    assert df_slice.shape[0] in (1, 0), 'must be one row'
-    arg = ' AND '.join([f'{col}=?' for col in df_slice.columns])
-    params = list(df_slice[col][0] for col in df_slice.columns)
-    return arg, params
+    keys = sorted(keys)
+    pk = [row[1] for row in con.execute(f'PRAGMA table_info({table})') if row[5] > 0]
+    if sorted(pk) == keys:
+        return True
+    for row in con.execute(f'PRAGMA index_list({table})'):
+        if row[2]:
+            cols = [col[2] for col in con.execute(f'PRAGMA index_info("{row[1]}")')]
+            if sorted(cols) == keys:
+                return True
+    return False
 
 
+@timed()
 def table_overwrite(table, df, primary_keys, con):
     '''
-    Appends a df to a table. Iterates through the df
-    row-wise and overwrites primary-key matches
+    Appends a df to a table, overwriting rows that
+    match on the primary keys
 
     Parameters
     ----------
     table: str
         table name
-    df: obj, pandas df
-        dataframe to add to db table
+    df: obj, pandas df or list of records
+        rows to add to db table
     primary_keys: list of str
         list of column name(s) that act as the
         table primary key
+
     con: sqlite3.Connection
+
+    Notes
+    -----
+    Runs in one transaction. If the table has a unique key on `primary_keys`
+    the rows are upserted with INSERT ... ON CONFLICT, otherwise matching
+    rows are deleted and the df is inserted, both with executemany
+    '''
+    cols, rows = table_rows(df)
+    insert = f'''
+    INSERT INTO {table} ({', '.join(cols)})
+    VALUES ({', '.join('?' * len(cols))})
     '''
-    cur = con.cursor()
-    existing = pd.read_sql(f'SELECT * from {table}', con)
-    for i in df.index:
-        df_slice = df.iloc[i:i+1].reset_index(drop=True)
-        primary_slice = df_slice[primary_keys]
-        match = pd.merge(primary_slice, existing, how='inner', indicator=True)
-        if 'both' in match['_merge'].tolist():
-            arg, params = delete_params(primary_slice)
-            cur.execute(f'DELETE from {table} WHERE {arg}', params)
-            logger.info('duplicate entry deleted')
-        logger.info('new entry loaded')
-        df_slice.to_sql(table, con, if_exists='append', index=False)
+    with con:
+        if unique_key_exists(con, table, primary_keys):
+            updates = ', '.join(f'{col}=excluded.{col}'
+                                for col in cols if col not in primary_keys)
+            action = f'UPDATE SET {updates}' if updates else 'NOTHING'
+            con.executemany(
+                f'{insert} ON CONFLICT ({", ".join(primary_keys)}) DO {action}', rows)
+        else:
+            arg = ' AND '.join([f'{col}=?' for col in primary_keys])
+            ix = [cols.index(col) for col in primary_keys]
+            keys = dict.fromkeys(tuple(row[i] for i in ix) for row in rows)
+            con.executemany(f'DELETE from {table} WHERE {arg}', list(keys))
+            con.executemany(insert, rows)
+    logger.info('%s entries loaded to %s', len(rows), table)
 
 
 def retrieve_json(df, json_col):
@@ -205,7 +353,7 @@ def retrieve_json(df, json_col):
     obj, dict
     '''
     df = df[json_col].reset_index(drop=True)
-    return ast.literal_eval(df[0])
+    return decode(df[0])
 
 
 def name_exists(name, con):
@@ -225,7 +373,7 @@ def name_exists(name, con):
     s = '''
     SELECT DISTINCT user_name FROM dim_user
     '''
-    distinct_users = pd.read_sql(s, con)
+    distinct_users = read_sql(s, con)
     if name in distinct_users['user_name'].tolist():
         return True
     else:
@@ -246,7 +394,7 @@ def get_user_id(user, con):
     SELECT user_id FROM dim_user
     WHERE user_name = ?
     '''
-    user_id = pd.read_sql(s, con, params=[user])
+    user_id = read_sql(s, con, params=[user])
     user_id = user_id.reset_index(drop=True)
     return user_id['user_id'][0]
 
@@ -269,7 +417,7 @@ def create_user_entry(name, email, con):
     s = '''
     SELECT ? as user_name, MAX(user_id) as user_id FROM dim_user
     '''
-    new_user = pd.read_sql(s, con, params=[name])
+    new_user = read_sql(s, con, params=[name])
 
     if new_user.user_id[0] is None:
         new_user['user_id'] = 1
@@ -328,7 +476,7 @@ def pull_prog(user_id, con):
     -------
     prog_dict: obj, dict
     '''
-    prog = pd.read_sql(
+    prog = read_sql(
         'SELECT * FROM dim_progression WHERE user_id = ?', con, params=[user_id])
     if prog.shape[0] == 0:
         logger.warning('No progression dict loaded')
@@ -356,6 +504,92 @@ def add_dicts(dict1, dict2):
     return new
 
 
+orm_summary_sql = '''
+SELECT user_id, COUNT(*) as entries, MAX(data_start_date) as max_start_date,
+MAX(publish_time) as max_publish_time
+FROM one_rep_max
+{where}
+GROUP BY user_id
+'''
+
+
+@timed()
+def load_context(con, dt=None):
+    '''
+    Bulk loads everything needed to build the workout of every
+    active user in a handful of set based queries
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    dt: timestamp, optional
+        date the `one_rep_max` rows are matched against - defaults
+        to today
+
+    Returns
+    -------
+    context: obj, dict
+        dict of pandas dfs keyed by table name - `dim_user`, `pause_workout`,
+        `one_rep_max` (rows covering `dt`), `accessory` (latest publish
+        per user), `dim_progression`, `report_fingerprint`, `orm_chart`
+        and `orm_summary` (one_rep_max row count and latest dates per user)
+
+    Notes
+    -----
+    Pass the context to DBHelper so lookups are served from memory
+    instead of one round trip per user
+    '''
+    if dt is None:
+        dt = now(date=True)
+    active = 'user_id IN (SELECT user_id FROM pause_workout WHERE pause_flag = "False")'
+    queries = {
+        'dim_user': (f'SELECT * FROM dim_user WHERE {active}', []),
+        'pause_workout': (f'SELECT * FROM pause_workout WHERE {active}', []),
+        'one_rep_max': (f'''
+        SELECT * FROM one_rep_max
+        WHERE {active}
+        AND data_start_date <= ?
+        AND data_end_date >= ?
+        ''', [dt, dt]),
+        'accessory': (f'''
+        SELECT a.* FROM accessory a
+        INNER JOIN
+        (SELECT user_id, MAX(publish_time) as publish_time
+        FROM accessory
+        WHERE {active}
+        GROUP BY user_id) b
+        USING (user_id, publish_time)
+        ''', []),
+        'dim_progression': (f'SELECT * FROM dim_progression WHERE {active}', []),
+        'report_fingerprint': (f'SELECT * FROM report_fingerprint WHERE {active}', []),
+        'orm_summary': (orm_summary_sql.format(where=f'WHERE {active}'), []),
+        'orm_chart': (f'SELECT * FROM orm_chart WHERE {active}', []),
+    }
+    context = {table: read_sql(s, con, params=params)
+               for table, (s, params) in queries.items()}
+    logger.info('context loaded for %s active users',
+                context['dim_user'].shape[0])
+    return context
+
+
+def context_pull(context, user_id, table):
+    '''
+    Equivalent of `table_pull` against a context from `load_context`
+
+    Parameters
+    ----------
+    context: obj, dict
+    user_id: int
+    table: str
+
+    Returns
+    -------
+    obj, pandas df
+    '''
+    df = context[table]
+    return df[df['user_id'] == user_id].reset_index(drop=True)
+
+
 def get_new_orm_dict(one_rep_max, user_id, con, prog_dict=None):
     '''
     Adds progression weights to the latest entry
@@ -415,12 +649,83 @@ def get_new_orm(one_rep_max, user_id, con, week=1):
     entry = pd.DataFrame({'user_id': user_id,
                           'data_start_date': new_dates[0],
                           'data_end_date': new_dates[1],
-                          'orm_dict': json.dumps(new_orm),
+                          'orm_dict': encode(new_orm),
                           'publish_time': now(date=False)}, index=[0])
 
     return entry[['user_id', 'data_start_date', 'data_end_date', 'orm_dict', 'publish_time']]
 
 
+def catch_up_orm(one_rep_max, user_id, prog_dict, dt=None):
+    '''
+    Works out every month missing between the latest one_rep_max
+    entry and the month covering `dt`, progressing the weights
+    by `prog_dict` each month
+
+    Parameters
+    ----------
+    one_rep_max: obj, pandas df
+        one_rep_max table for one user
+    user_id: int
+    prog_dict: obj, dict
+    dt: timestamp, optional
+        date to catch up to - defaults to today
+
+    Returns
+    -------
+    entries: obj, pandas df
+        new entries for one_rep_max - empty if the latest entry
+        already ends on or after `dt`
+    None
+        If one_rep_max is empty
+    '''
+    latest = get_latest(one_rep_max)
+    if latest is None:
+        logger.warning('no info in one_rep_max - populate it first')
+        return
+    if dt is None:
+        dt = now(date=True)
+    cols = ['user_id', 'data_start_date',
+            'data_end_date', 'orm_dict', 'publish_time']
+    start, end = new_month(latest['data_end_date'][0] + datetime.timedelta(days=1),
+                           timeskip='forward')
+    if pd.Timestamp(dt) < start:
+        return pd.DataFrame(columns=cols)
+
+    months = (pd.Timestamp(dt) - start).days // 28 + 1
+    offsets = pd.to_timedelta(np.arange(months) * 28, unit='D')
+    orm_dict = retrieve_json(latest, 'orm_dict')
+    orm_dicts = []
+    for _ in range(months):
+        orm_dict = add_dicts(orm_dict, prog_dict)
+        orm_dicts.append(encode(orm_dict))
+    entries = pd.DataFrame({'user_id': user_id,
+                            'data_start_date': start + offsets,
+                            'data_end_date': end + offsets,
+                            'orm_dict': orm_dicts,
+                            'publish_time': now(date=False)})
+    return entries[cols]
+
+
+def apply_writes(con, writes):
+    '''
+    Applies writes deferred by DBHelper instances, with one
+    `table_overwrite` per table
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    writes: list of tuple
+        (table, entry, primary_keys) from `DBHelper.pending_writes`
+    '''
+    grouped = {}
+    for table, entry, primary_keys in writes:
+        cols, rows = table_rows(entry)
+        grouped.setdefault((table, tuple(primary_keys), tuple(cols)), []).extend(rows)
+    for (table, primary_keys, cols), rows in grouped.items():
+        table_overwrite(table, [dict(zip(cols, row)) for row in rows],
+                        list(primary_keys), con)
+
+
 class DBHelper(object):
     '''
     Class for performing all database operations for
@@ -434,19 +739,81 @@ class DBHelper(object):
     email: str, optional
         email of username - only needed if user has not yet
         been populated in dim_users
+    context: obj, dict, optional
+        output of `load_context` - lookups are served from it
+        instead of the database where possible
+    defer_writes: bool
+        if True, cache writes made through `overwrite` are queued in
+        `pending_writes` for another connection to apply
+    user_id: int, optional
+        id of `user` if it has already been looked up - the user
+        is then neither looked up nor created
     '''
 
-    def __init__(self, con, user, email=None):
+    def __init__(self, con, user, email=None, context=None, defer_writes=False, user_id=None):
         self._user_name = user
         self.con = con
-        if name_exists(user, con) == False:
-            create_user(user, email, con)
-        else:
+        self._context = context
+        self.defer_writes = defer_writes
+        self.pending_writes = []
+        self._stale = set()
+        self._orm_cache = None
+        self._orm_entry = None
+        known = None
+        if context is not None:
+            dim_user = context['dim_user']
+            known = dim_user[dim_user['user_name'] == user].reset_index(drop=True)
+        if user_id is not None:
+            self.user_id = user_id
+        elif known is not None and known.shape[0] > 0:
             print(f'Welcome back {user}!')
-        self.user_id = get_user_id(user, con)
+            self.user_id = known['user_id'][0]
+        else:
+            if name_exists(user, con) == False:
+                create_user(user, email, con)
+            else:
+                print(f'Welcome back {user}!')
+            self.user_id = get_user_id(user, con)
         self.user = user
         # assert type(self.user_id) == int, 'user_id must be int'
 
+    def from_context(self, table):
+        '''
+        Pulls this user's rows of `table` from the context
+
+        Parameters
+        ----------
+        table: str
+
+        Returns
+        -------
+        obj, pandas df
+        None
+            If there is no context, or the table has been
+            written to since the context was loaded
+        '''
+        if self._context is None or table in self._stale:
+            return None
+        return context_pull(self._context, self.user_id, table)
+
+    def overwrite(self, table, entry, primary_keys):
+        '''
+        `table_overwrite` on this instance's connection, or queued
+        in `pending_writes` if writes are deferred
+
+        Parameters
+        ----------
+        table: str
+        entry: obj, pandas df or list of records or dicts
+        primary_keys: list of str
+        '''
+        if self.defer_writes == True:
+            self.pending_writes.append((table, entry, primary_keys))
+        else:
+            table_overwrite(table, entry, primary_keys, self.con)
+        self._stale.add(table)
+
+    @timed()
     def set_dim_prog(self, prog_dict):
         '''
         Sets dim_progression
@@ -461,12 +828,13 @@ class DBHelper(object):
             if prog_dict is not a dict
         '''
         assert type(prog_dict) == dict, 'prog_dict must be dict'
-        entry = pd.DataFrame.from_dict(
-            {0: {'user_id': self.user_id, 'prog_dict': json.dumps(prog_dict)}}, orient='index')
-        table_overwrite('dim_progression', entry, ['user_id'], self.con)
+        entry = ProgressionEntry(self.user_id, encode(prog_dict))
+        table_overwrite('dim_progression', [entry], ['user_id'], self.con)
+        self._stale.add('dim_progression')
         logger.info('dict is valid - dim_progression populated')
-        return entry
+        return records_to_frame([entry])
 
+    @timed()
     def set_accessory(self, accessory_df):
         '''
         Loads entries to accessory table
@@ -493,9 +861,11 @@ class DBHelper(object):
         accessory_df['publish_time'] = now(date=False)
         accessory_df.to_sql('accessory', self.con,
                             if_exists='append', index=False)
+        self._stale.add('accessory')
         logger.info('dataframe is valid - accessory populated')
         return accessory_df.head(3)
 
+    @timed()
     def set_one_rep_max(self, orm_dict, start_week=None):
         '''
         Sets one_rep_max for the current month
@@ -517,24 +887,28 @@ class DBHelper(object):
         *TODO: Add functionality to set what week the workout starts on
         (parameterize month creation)
         '''
-        month, week = get_dates(self.user_id, self.con)
         full_orm = table_pull(self.con, self.user_id, 'one_rep_max')
-        orm_dict = json.dumps(orm_dict)
+        month = get_month(full_orm) if full_orm.shape[0] > 0 else None
+        orm_dict = encode(orm_dict)
         buffer = buffer_week()
+        self.invalidate_orm()
         if month is not None:
             if month['data_start_date'][0] == buffer[0] and month['data_end_date'][0] == buffer[1]:
                 logger.warning(
                     'Overwriting entry after buffer week - make sure this is what you wanted')
                 month = None
         if month is not None:
-            update = month.copy()
+            updates = OrmEntry.from_frame(month)
+            for update in updates:
+                if start_week is not None:
+                    update.data_end_date = new_month(week=start_week)[1]
+                update.orm_dict = orm_dict
+                update.publish_time = now(date=False)
             if start_week is not None:
-                new_dates = new_month(week=start_week)
-                update['data_end_date'] = new_dates[1]
                 logger.info('start week set to %s', start_week)
-            update['orm_dict'] = orm_dict
-            table_overwrite('one_rep_max', update, [
+            table_overwrite('one_rep_max', updates, [
                             'user_id', 'data_start_date'], self.con)
+            self.refresh_plan(updates)
             logger.info('dict is valid - one_rep_max overwitten')
         else:
             need_buffer = True
@@ -542,7 +916,7 @@ class DBHelper(object):
             if full_orm.shape[0] > 0:
                 for i in [0, 1]:
                     match = get_month(full_orm, custom_dt=buffer[i])
-                    if match:
+                    if match is not None:
                         need_buffer = False
             if need_buffer == False:
                 logger.info('buffer week not needed')
@@ -551,16 +925,17 @@ class DBHelper(object):
             new_dates = [new_month(week=start_week)]
             if need_buffer == True:
                 new_dates = new_dates + [buffer]
+            updates = []
             for dates in new_dates:
-                update = pd.DataFrame.from_dict({0: {'user_id': self.user_id,
-                                                     'data_start_date': dates[0],
-                                                     'data_end_date': dates[1],
-                                                     'orm_dict': orm_dict,
-                                                     'publish_time': now(date=False)}}, orient='index')
-                table_overwrite('one_rep_max', update, [
+                update = OrmEntry(self.user_id, dates[0], dates[1], orm_dict, now(date=False))
+                table_overwrite('one_rep_max', [update], [
                     'user_id', 'data_start_date'], self.con)
+                updates.append(update)
+            self.refresh_plan(updates)
             logger.info('dict is valid - new entries added to one_rep_max')
+        self.invalidate_orm()
 
+    @timed()
     def progress_one_rep_max(self):
         '''
         Adds progression_dict onto one_rep_max until the current
@@ -568,7 +943,9 @@ class DBHelper(object):
 
         Notes
         -----
-        Does nothing if one_rep_max is empty or the current month is already populated
+        * Does nothing if one_rep_max is empty or the current month is already populated
+        * All missing months are worked out in memory by `catch_up_orm` and
+        loaded in one transaction
         '''
         orm = self.get_orm()
         if orm is None:
@@ -577,18 +954,113 @@ class DBHelper(object):
                 logger.warning(
                     'No orm weights are set - you must seed the db with your starting weight using self.set_one_rep_max')
                 return None
+            prog = self.from_context('dim_progression')
+            if prog is not None and prog.shape[0] > 0:
+                prog_dict = retrieve_json(prog, 'prog_dict')
             else:
-                while orm is None:
-                    latest = get_latest(full_orm)
-                    new_orm = get_new_orm(full_orm, self.user_id, self.con)
-                    new_orm.to_sql('one_rep_max', self.con,
-                                   if_exists='append', index=False)
-                    logger.info('orm progressed by one month')
-                    orm = self.get_orm()
+                prog_dict = pull_prog(self.user_id, self.con)
+            assert prog_dict is not None, 'dim_progression is not populated'
+            entries = catch_up_orm(full_orm, self.user_id, prog_dict)
+            if entries.shape[0] == 0:
+                logger.warning(
+                    'latest one_rep_max entry starts after today - no month to progress')
+                return None
+            with self.con:
+                entries.to_sql('one_rep_max', self.con,
+                               if_exists='append', index=False)
+            self.refresh_plan(OrmEntry.from_frame(entries))
+            logger.info('orm progressed by %s month(s)', entries.shape[0])
+            self.invalidate_orm()
         else:
             logger.info(
                 'using current orm - use self.set_one_rep_max if you wish to modify it')
 
+    @timed()
+    def refresh_plan(self, entries):
+        '''
+        Rewrites workout_plan for one_rep_max months - must be
+        called after every write to one_rep_max
+
+        Parameters
+        ----------
+        entries: list of OrmEntry
+            the months written
+        '''
+        self.overwrite('workout_plan', plan_rows(entries), plan_keys)
+
+    @timed()
+    def get_plan(self, week=None):
+        '''
+        Gets the stored plan of this month, filling it in if the
+        month was added without one
+
+        Parameters
+        ----------
+        week: int, optional
+            only return this week
+
+        Returns
+        -------
+        list of PlanRow
+        None
+            If there is no one_rep_max populated
+        '''
+        orm = self.get_orm_entry()
+        if orm is None:
+            return None
+        s = 'SELECT * FROM workout_plan WHERE user_id = ? AND data_start_date = ?'
+        params = [self.user_id, orm.data_start_date]
+        if week is not None:
+            s += ' AND week = ?'
+            params.append(week)
+        rows = [PlanRow(*row) for row in self.con.execute(s, params)]
+        metrics.add('rows_read', len(rows))
+        if len(rows) == 0:
+            rows = plan_rows([orm])
+            self.overwrite('workout_plan', rows, plan_keys)
+            if week is not None:
+                rows = [row for row in rows if row.week == week]
+        return rows
+
+    def invalidate_orm(self):
+        '''
+        Drops the cached one_rep_max month and everything derived
+        from one_rep_max - must be called after every write to it
+        '''
+        self._stale.update(['one_rep_max', 'orm_summary', 'orm_chart'])
+        self._orm_cache = None
+        self._orm_entry = None
+
+    @timed()
+    def current_orm(self):
+        '''
+        Resolves the one_rep_max month and week for today once,
+        and serves every later call from the cache until
+        `invalidate_orm` is called
+
+        Returns
+        -------
+        orm: obj, pandas df
+            None if there is no one_rep_max populated
+        week: int
+            None if there is no one_rep_max populated
+        '''
+        if self._orm_cache is not None:
+            return self._orm_cache
+        orm = self.from_context('one_rep_max')
+        if orm is None:
+            orm = table_pull(self.con, self.user_id, 'one_rep_max')
+        if orm.shape[0] == 0:
+            self._orm_cache = (None, None)
+            return self._orm_cache
+        # month and week in one lookup
+        resolved = resolve_dates(orm, [self.user_id], [now(date=True)])
+        if pd.isnull(resolved['week'][0]):
+            self._orm_cache = (None, None)
+        else:
+            self._orm_cache = (resolved[list(orm.columns)], int(resolved['week'][0]))
+        return self._orm_cache
+
     def get_orm(self):
         '''
         Gets one_rep_max for this month
@@ -599,21 +1071,51 @@ class DBHelper(object):
         None
             If there is no one_rep_max populated
         '''
-        month, week = get_dates(self.user_id, self.con)
-        if month is None:
-            return None
-        s = '''
-        SELECT * FROM
-        one_rep_max
-        WHERE user_id = ?
-        AND data_start_date = ?
-        AND data_end_date = ?
-        '''
-        start = month['data_start_date'][0]
-        end = month['data_end_date'][0]
-        orm = pd.read_sql(s, self.con, params=[self.user_id, start, end])
+        orm, week = self.current_orm()
         return orm
 
+    def get_orm_entry(self):
+        '''
+        Gets one_rep_max for this month as a record
+
+        Returns
+        -------
+        obj, OrmEntry
+        None
+            If there is no one_rep_max populated
+        '''
+        if self._orm_entry is None:
+            orm = self.get_orm()
+            if orm is None:
+                return None
+            self._orm_entry = OrmEntry.from_frame(orm)[0]
+        return self._orm_entry
+
+    def get_current_week(self):
+        '''
+        Gets the week of the current one_rep_max month
+
+        Returns
+        -------
+        week: int
+        None
+            If there is no one_rep_max populated
+        '''
+        orm, week = self.current_orm()
+        return week
+
+    def get_week_vals(self):
+        '''
+        Gets the current week information based on the
+        `one_rep_max` pulled from the database
+        '''
+        orm = self.get_orm_entry()
+        week = self.get_current_week()
+        start = orm.data_start_date + datetime.timedelta(days=(week-1)*7)
+        end = start + datetime.timedelta(days=7)
+        return week, start.date(), end.date()
+
+    @timed()
     def get_accessory(self):
         '''
         Gets most recently published accessory df from database
@@ -622,6 +1124,10 @@ class DBHelper(object):
         -------
         obj, pandas df
         '''
+        cols = ['me_name', 'ae_name', 'ae_weight', 'sets', 'reps']
+        acc = self.from_context('accessory')
+        if acc is not None:
+            return acc[cols]
         s = '''
         WITH max_time as 
         (select MAX(publish_time) as dt_max
@@ -631,10 +1137,134 @@ class DBHelper(object):
         WHERE user_id = ?
         AND publish_time = (select dt_max from max_time)
         '''
-        acc = pd.read_sql(s, self.con, params=[self.user_id, self.user_id])
-        cols = ['me_name', 'ae_name', 'ae_weight', 'sets', 'reps']
+        acc = read_sql(s, self.con, params=[self.user_id, self.user_id])
         return acc[cols]
 
+    def get_accessory_lifts(self):
+        '''
+        Gets the most recently published accessory exercises
+
+        Returns
+        -------
+        list of AccessoryLift
+        '''
+        return AccessoryLift.from_frame(self.get_accessory())
+
+    def get_accessory_publish_time(self):
+        '''
+        Gets the publish_time of the most recent accessory df
+
+        Returns
+        -------
+        obj, pandas Timestamp
+        None
+            If there is no accessory populated
+        '''
+        acc = self.from_context('accessory')
+        if acc is not None:
+            publish_time = acc['publish_time'].max()
+        else:
+            publish_time = self.con.execute(
+                'SELECT MAX(publish_time) FROM accessory WHERE user_id = ?',
+                [self.user_id]).fetchone()[0]
+        if publish_time is None or pd.isnull(publish_time):
+            return None
+        return pd.Timestamp(publish_time)
+
+    @timed()
+    def get_fingerprint(self, file):
+        '''
+        Gets the stored fingerprint of the last report built to `file`
+
+        Parameters
+        ----------
+        file: str
+
+        Returns
+        -------
+        str
+        None
+            If no report has been built
+        '''
+        fingerprints = self.from_context('report_fingerprint')
+        if fingerprints is None:
+            fingerprints = table_pull(self.con, self.user_id, 'report_fingerprint')
+        match = fingerprints[fingerprints['file'] == file].reset_index(drop=True)
+        if match.shape[0] == 0:
+            return None
+        return match['fingerprint'][0]
+
+    @timed()
+    def set_fingerprint(self, file, fingerprint):
+        '''
+        Stores the fingerprint of the report built to `file`
+
+        Parameters
+        ----------
+        file: str
+        fingerprint: str
+        '''
+        entry = [{'user_id': self.user_id, 'file': file, 'fingerprint': fingerprint,
+                  'build_time': now(date=False)}]
+        self.overwrite('report_fingerprint', entry, ['user_id', 'file'])
+
+    @timed()
+    def get_orm_chart_key(self):
+        '''
+        Gets a key that changes whenever a one_rep_max row is added,
+        or the chart timeline changes
+
+        Returns
+        -------
+        str
+        '''
+        summary = self.from_context('orm_summary')
+        if summary is None:
+            summary = read_sql(orm_summary_sql.format(where='WHERE user_id = ?'),
+                              self.con, params=[self.user_id])
+        if summary.shape[0] == 0:
+            return '0'
+        return '|'.join([str(timeline_version)] + [str(summary[col][0]) for col in
+                        ['entries', 'max_start_date', 'max_publish_time']])
+
+    @timed()
+    def get_orm_chart(self, key):
+        '''
+        Gets the cached orm progression chart
+
+        Parameters
+        ----------
+        key: str
+            from `get_orm_chart_key`
+
+        Returns
+        -------
+        svg: str
+        None
+            If no chart is cached for `key`
+        '''
+        chart = self.from_context('orm_chart')
+        if chart is None:
+            chart = table_pull(self.con, self.user_id, 'orm_chart')
+        chart = chart[chart['chart_key'] == key].reset_index(drop=True)
+        if chart.shape[0] == 0:
+            return None
+        return chart['svg'][0]
+
+    @timed()
+    def set_orm_chart(self, key, svg):
+        '''
+        Caches the orm progression chart
+
+        Parameters
+        ----------
+        key: str
+            from `get_orm_chart_key`
+        svg: str
+        '''
+        entry = [{'user_id': self.user_id, 'chart_key': key, 'svg': svg}]
+        self.overwrite('orm_chart', entry, ['user_id'])
+
     def pause_workout(self):
         '''
         Flags workout as paused
@@ -667,7 +1297,7 @@ class DBHelper(object):
         users: list of int
             list of user_ids
         '''
-        entries = pd.read_sql(
+        entries = read_sql(
             'SELECT * FROM pause_workout WHERE pause_flag = "False"', self.con)
         users = entries['user_id'].unique().tolist()
         return users
@@ -2,8 +2,8 @@
 
 import datetime
 
+import numpy as np
 import pandas as pd
-import pytz
 
 
 def now(tz='US/Eastern', date=True):
@@ -18,6 +18,8 @@ def now(tz='US/Eastern', date=True):
         True to strip hour, minute, second, microsecond
         info, else False
     '''
+    import pytz
+
     ts = datetime.datetime.now(pytz.timezone(tz))
     ts = ts.replace(tzinfo=None)
     if date == True:
@@ -84,6 +86,38 @@ def new_month(start=None, timeskip='forward', week=1):
     return start, end
 
 
+def week_number(start, end, dt):
+    '''
+    Vectorized week-of-month calculation
+
+    Parameters
+    ----------
+    start: array-like of timestamps
+        month start dates
+    end: array-like of timestamps
+        month end dates
+    dt: array-like of timestamps
+        dates to get the week of
+
+    Returns
+    -------
+    week: obj, numpy array of float
+        week number of each dt, NaN where any input is missing
+
+    Notes
+    -----
+    One week long entries (buffer weeks) are always week 1
+    '''
+    start = np.asarray(pd.to_datetime(start), dtype='datetime64[D]')
+    end = np.asarray(pd.to_datetime(end), dtype='datetime64[D]')
+    dt = np.asarray(pd.to_datetime(dt), dtype='datetime64[D]')
+    days = (dt - start).astype('timedelta64[D]').astype(float)
+    days[np.isnat(dt) | np.isnat(start)] = np.nan
+    week = days // 7 + 1
+    week[(end - start) == np.timedelta64(6, 'D')] = 1
+    return week
+
+
 def get_month(one_rep_max, custom_dt=None):
     '''
     Gets entry from one_rep_max that matches either the
@@ -92,24 +126,29 @@ def get_month(one_rep_max, custom_dt=None):
     Parameters
     ----------
     one_rep_max: obj, pandas df
+        one_rep_max rows of one user
     custom_dt: timestamp, optional
 
     Returns
     -------
     month: obj, pandas df
         df row corresponding to input timestamp
+
+    Notes
+    -----
+    Resolved by `resolve_dates` - if months overlap, the
+    one starting last is picked
     '''
     if custom_dt is None:
         dt = now(date=True)
     else:
         dt = custom_dt
-    bix = one_rep_max.apply(
-        lambda x: x['data_start_date'] <= dt <= x['data_end_date'], axis=1)
-    month = one_rep_max[bix].reset_index(drop=True)
-    if month.shape[0] == 0:
+    if one_rep_max.shape[0] == 0:
         return None
-    else:
-        return month
+    resolved = resolve_dates(one_rep_max, one_rep_max['user_id'][:1], [dt])
+    if pd.isnull(resolved['week'][0]):
+        return None
+    return resolved[list(one_rep_max.columns)]
 
 
 def get_week(one_rep_max):
@@ -120,26 +159,65 @@ def get_week(one_rep_max):
     Parameters
     ----------
     one_rep_max: obj, pandas df
+        one_rep_max rows of one user
 
     Returns
     -------
     week: int
     '''
-    dt = now(date=True)
-    month = get_month(one_rep_max)
-    if month is None:
+    if one_rep_max.shape[0] == 0:
         return None
-    month = month.reset_index(drop=True)
-    start = month['data_start_date'][0]
-    end = month['data_end_date'][0]
-    if (end-start).days == 6:
-        week = 1
-        return week
+    resolved = resolve_dates(one_rep_max, one_rep_max['user_id'][:1], [now(date=True)])
+    week = resolved['week'][0]
+    return None if pd.isnull(week) else int(week)
 
-    for week in range(1, 5):
-        days = week * 7 - 1
-        if start <= dt <= start + datetime.timedelta(days):
-            return week
+
+def resolve_dates(one_rep_max, user_ids, dts):
+    '''
+    Resolves the one_rep_max month and week for many
+    (user_id, date) pairs in one call
+
+    Parameters
+    ----------
+    one_rep_max: obj, pandas df
+        one_rep_max rows for any number of users
+    user_ids: array-like of int
+    dts: array-like of timestamps
+        same length as user_ids
+
+    Returns
+    -------
+    resolved: obj, pandas df
+        one row per input pair, in input order, with `user_id`, `dt`,
+        the columns of the matching one_rep_max month and `week`.
+        Month columns are null where no month covers the date
+
+    Notes
+    -----
+    Months are matched with a binary search over each user's start dates
+    (`pd.merge_asof`), picking the latest month starting on or before
+    the date
+    '''
+    queries = pd.DataFrame({'user_id': np.asarray(user_ids, dtype='int64'),
+                            'dt': pd.to_datetime(dts).astype('datetime64[ns]')})
+    queries['query_order'] = np.arange(queries.shape[0])
+    months = one_rep_max.copy()
+    months['user_id'] = months['user_id'].astype('int64')
+    for col in ['data_start_date', 'data_end_date']:
+        months[col] = pd.to_datetime(months[col]).astype('datetime64[ns]')
+    months = months.sort_values('data_start_date')
+
+    resolved = pd.merge_asof(queries.sort_values('dt'), months, left_on='dt',
+                             right_on='data_start_date', by='user_id',
+                             direction='backward')
+    miss = ~(resolved['dt'] <= resolved['data_end_date'])
+    month_cols = [col for col in months.columns if col != 'user_id']
+    resolved.loc[miss, month_cols] = None
+    resolved['week'] = pd.array(week_number(resolved['data_start_date'],
+                                            resolved['data_end_date'],
+                                            resolved['dt']), dtype='Int64')
+    resolved = resolved.sort_values('query_order').reset_index(drop=True)
+    return resolved.drop(columns='query_order')
 
 
 def get_latest(one_rep_max):
@@ -162,64 +240,53 @@ def get_latest(one_rep_max):
     return latest
 
 
-def get_dates(user_id, con):
-    '''
-    Pulls one_rep_max from the databse and returns the 
-    `month` and `week` output
+# bump when `orm_timeline` output changes, so cached charts are redrawn
+timeline_version = 2
 
-    Parameters
-    ----------
-    user_id: int
-    con: sqlite3.Connection
-    '''
-    orm = pd.read_sql(
-        'SELECT * FROM one_rep_max WHERE user_id = ?', con, params=[user_id])
-    if orm.shape[0] == 0:
-        return None, None
-    else:
-        month = get_month(orm)
-        week = get_week(orm)
-        return month, week
 
-def get_full_dates(df):
-    """Gets the full date range for a given dataframe
-
-    Parameters
-    ----------
-    df: obj, pandas.DataFrame
-
-    Returns
-    -------
-    full_dt: obj, pandas.DataFrame
-        dataframe with two columns `data_start_date` and
-        `data_end_date` containing full date range
-    """
-    start_dates = pd.to_datetime(df['data_start_date'])
-    min_date = min(start_dates)
-    max_date = max(start_dates)
-    months = int((max_date - min_date).days / 28)
-    full_range = [min_date + datetime.timedelta(weeks=4*x) for x in range(0,months+1)]
-    full_dt = pd.DataFrame({'data_start_date':full_range})
-    full_dt['data_end_date'] = full_dt['data_start_date']+datetime.timedelta(days=27)
-    return full_dt
-
-
-def backfill_dates(df, full_dt):
-    """Backfills missing dates in a df
+def orm_timeline(orm, freq='M'):
+    '''
+    Builds a dense one_rep_max series for any number of users,
+    forward filling periods without an entry
 
     Parameters
     ----------
-    df: obj, pandas.DataFrame
-    full_dt: obj, pandas.DataFrame
+    orm: obj, pandas df
+        `user_id`, `data_start_date` and one column per lift, like
+        `functions.viz_funcs.format_orm` output with `user_id` added
+    freq: str
+        `M` for one row per 28 day month, `W` for one row per week
 
     Returns
     -------
-    full_data: obj, pandas.DataFrame
-        df but with backfilled dates
-    """
-    for col in ['data_start_date', 'data_end_date']:
-        df[col] = pd.to_datetime(df[col])
-
-    full_data = pd.merge(full_dt, df, how='left', on=['data_start_date', 'data_end_date'])
-    full_data = full_data.fillna(method='backfill')
-    return full_data
\ No newline at end of file
+    timeline: obj, pandas df
+        `user_id`, `data_start_date` and the lift columns, one row per
+        period from each user's first entry to their last. Weights are
+        float32 (exact for 2.5lb steps), dates datetime64[s]
+
+    Notes
+    -----
+    Every entry starts a row on its own `data_start_date`, so short
+    entries such as buffer weeks never shift the months after them,
+    and the last entry is always included. Gaps up to the next entry,
+    e.g. from paused months, are filled with rows every period that
+    carry the entry's weights forward
+    '''
+    assert freq in ['M', 'W'], 'freq must be "M" or "W"'
+    step = pd.Timedelta(days=28 if freq == 'M' else 7)
+    lifts = [col for col in orm.columns
+             if col not in ['user_id', 'data_start_date', 'data_end_date', 'publish_time']]
+    entries = orm[['user_id', 'data_start_date'] + lifts].copy()
+    entries['user_id'] = entries['user_id'].astype('int64')
+    entries['data_start_date'] = pd.to_datetime(entries['data_start_date']).astype('datetime64[s]')
+    entries[lifts] = entries[lifts].astype('float32')
+    entries = entries.sort_values(['user_id', 'data_start_date']).reset_index(drop=True)
+
+    # each entry covers the periods up to the next entry of the same user
+    span = entries.groupby('user_id')['data_start_date'].shift(-1) - entries['data_start_date']
+    periods = np.maximum(-(-span.fillna(step) // step).to_numpy(), 1).astype('int64')
+    offsets = np.arange(periods.sum()) - np.repeat(np.cumsum(periods) - periods, periods)
+    timeline = entries.loc[np.repeat(entries.index.to_numpy(), periods)].reset_index(drop=True)
+    timeline['data_start_date'] = (timeline['data_start_date'] + offsets * step).astype('datetime64[s]')
+    timeline['user_id'] = timeline['user_id'].astype('int32')
+    return timeline
@@ -0,0 +1,199 @@
+'''functions for exporting database snapshots to columnar files'''
+
+import argparse
+import json
+import os
+import time
+
+import pandas as pd
+
+from functions.db_funcs import get_db_con
+from functions.json_funcs import explode_column
+from functions.log_funcs import get_logger
+
+logger = get_logger('export')
+
+formats = {'parquet': 'parquet', 'ipc': 'arrow'}
+
+state_file = '_export_state.json'
+
+
+def import_pyarrow():
+    '''
+    Imports pyarrow, which is only needed for exports
+
+    Raises
+    ------
+    ImportError
+        if pyarrow is not installed
+    '''
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError('columnar exports need pyarrow - pip install pyarrow')
+    return pyarrow
+
+
+def read_state(out_dir):
+    '''
+    Reads the publish_time watermarks of previous exports
+
+    Parameters
+    ----------
+    out_dir: str
+
+    Returns
+    -------
+    state: obj, dict
+        {table: latest exported publish_time}
+    '''
+    path = os.path.join(out_dir, state_file)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(out_dir, state):
+    '''
+    Saves the publish_time watermarks
+    '''
+    with open(os.path.join(out_dir, state_file), 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+def pull_since(con, table, since=None):
+    '''
+    Pulls the rows of a table published after a watermark
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    table: str
+    since: str, optional
+        publish_time watermark - pulls the whole table if None
+
+    Returns
+    -------
+    obj, pandas df
+    '''
+    if since is None:
+        return pd.read_sql(f'SELECT * FROM {table}', con)
+    return pd.read_sql(f'SELECT * FROM {table} WHERE publish_time > ?', con, params=[since])
+
+
+def write_dataset(df, path, fmt, partition_col=None, batch_id=None):
+    '''
+    Writes a df as a columnar dataset
+
+    Parameters
+    ----------
+    df: obj, pandas df
+    path: str
+        dataset directory
+    fmt: str
+        `parquet` or `ipc` (arrow ipc / feather v2)
+    partition_col: str, optional
+        column to hive partition the files by
+    batch_id: str, optional
+        unique id for the written files - files from earlier batches
+        are kept, so exports can append
+    '''
+    pa = import_pyarrow()
+    assert fmt in formats, f'fmt must be one of {list(formats)}'
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    batch_id = batch_id if batch_id is not None else 'full'
+    pa.dataset.write_dataset(table, path, format='ipc' if fmt == 'ipc' else fmt,
+                             partitioning=[partition_col] if partition_col else None,
+                             partitioning_flavor='hive' if partition_col else None,
+                             basename_template=f'part-{batch_id}-{{i}}.{formats[fmt]}',
+                             existing_data_behavior='overwrite_or_ignore')
+
+
+def clear_dataset(path):
+    '''
+    Deletes the files of a dataset written by `write_dataset`
+    '''
+    if not os.path.isdir(path):
+        return
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            if name.startswith('part-'):
+                os.remove(os.path.join(root, name))
+        if root != path and len(os.listdir(root)) == 0:
+            os.rmdir(root)
+
+
+def export_db(con, out_dir, fmt='parquet', incremental=True):
+    '''
+    Exports `one_rep_max`, `accessory` and `dim_user` to columnar
+    files for analysis outside the operational database
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    out_dir: str
+    fmt: str
+        `parquet` or `ipc`
+    incremental: bool
+        if True, only rows published since the last export are
+        appended - else the snapshot is rebuilt from scratch
+
+    Returns
+    -------
+    exported: obj, dict
+        rows written per table
+
+    Notes
+    -----
+    * `one_rep_max` has `orm_dict` exploded into one column per lift and
+    is partitioned by the month of `data_start_date`, `accessory` by the
+    month of `publish_time`. `dim_user` is small and rewritten every run
+    * A row republished with a newer publish_time is appended again, so
+    readers should keep the latest publish_time per key
+    '''
+    import_pyarrow()
+    os.makedirs(out_dir, exist_ok=True)
+    state = read_state(out_dir) if incremental == True else {}
+    batch_id = str(time.time_ns())
+    if incremental == False:
+        batch_id = 'full'
+        for table in ['one_rep_max', 'accessory', 'dim_user']:
+            clear_dataset(os.path.join(out_dir, table))
+
+    exported = {}
+    orm = pull_since(con, 'one_rep_max', state.get('one_rep_max'))
+    if orm.shape[0] > 0:
+        state['one_rep_max'] = str(orm['publish_time'].max())
+        orm = explode_column(orm, 'orm_dict')
+        orm['month'] = pd.to_datetime(orm['data_start_date']).dt.strftime('%Y-%m')
+        write_dataset(orm, os.path.join(out_dir, 'one_rep_max'), fmt, 'month', batch_id)
+    exported['one_rep_max'] = orm.shape[0]
+
+    acc = pull_since(con, 'accessory', state.get('accessory'))
+    if acc.shape[0] > 0:
+        state['accessory'] = str(acc['publish_time'].max())
+        acc['month'] = pd.to_datetime(acc['publish_time']).dt.strftime('%Y-%m')
+        write_dataset(acc, os.path.join(out_dir, 'accessory'), fmt, 'month', batch_id)
+    exported['accessory'] = acc.shape[0]
+
+    dim_user = pull_since(con, 'dim_user')
+    clear_dataset(os.path.join(out_dir, 'dim_user'))
+    write_dataset(dim_user, os.path.join(out_dir, 'dim_user'), fmt)
+    exported['dim_user'] = dim_user.shape[0]
+
+    write_state(out_dir, state)
+    logger.info('snapshot exported to %s - %s', out_dir, exported)
+    return exported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports a columnar snapshot of the workout db')
+    parser.add_argument('out_dir')
+    parser.add_argument('--db', default='workout.db')
+    parser.add_argument('--format', default='parquet', choices=list(formats))
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild the snapshot instead of appending new rows')
+    args = parser.parse_args()
+    export_db(get_db_con(args.db), args.out_dir, args.format, incremental=not args.full)
@@ -1,131 +1,179 @@
 '''functions for wrapping df output in html'''
 
-from functions.workout_funcs import reference_gen
+import html
+import io
+import numbers
+import re
+from string import Template
+
+import numpy as np
+
+from functions.record_funcs import AccessoryLift, ReferenceSet, WorkoutSet, table_rows
+from functions.workout_funcs import lifts, reference_sets
 
 
 default_style = 'th {background-color: #3498db;}'
 
+# bump whenever the rendered output changes, so incremental builds rebuild
+template_version = 3
 
-def html_wrap(df):
-    '''
-    Converts a pandas dataframe to an html string with
-    bootstrap formatting
+table_classes = ['table-bordered', 'table-striped', 'table-hover',
+                 'table-condensed', 'span6', 'text-center']
 
-    Parameters
-    ----------
-    df: obj, pandas df
+border_td = '<td style="border-bottom-style: solid; border-bottom: .5px solid black;">'
 
-    Returns
-    -------
-    html: str
+border_terms = ['squat', 'deadlift', 'ohp', 'bench']
+
+
+def is_float_column(values):
+    '''
+    Checks if pandas would store a column of values as float64 - numbers
+    and missing values only, with at least one float
     '''
-    html = df.to_html(classes=["table-bordered", "table-striped", "table-hover",
-                               "table-condensed", "span6", "text-center"], index=False)
-    html = html.replace('<th>', '<th class="text-center">')
-    return html
+    has_float = False
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, numbers.Real):
+            return False
+        has_float = has_float or isinstance(value, (float, np.floating))
+    return has_float
 
 
-def border_apply(html, search_term, td_count):
+def format_column(values):
     '''
-    applies a border style to all <td> elements for the last occurance
-    of a particular term in a table
+    Formats the values of a column the way `DataFrame.to_html` does
 
     Parameters
     ----------
-    html: str
-        html string
-    search_term: str
-        value of a row to search for last occurences of
-    td_count: int
-        count of td objects to apply style to
+    values: list
 
     Returns
     -------
-    parsed: str
-        html string parsed with border <td> formatting
+    list of str
 
     Notes
     -----
-    1. Requires column to seperate values by to be first column
-    2. Kind of janky... should find a way to overwrite bootstrap
-    style and apply directly to <tr>
+    floats in a column share the number of decimals needed by the
+    most precise value (at least 1, at most 6)
     '''
-    border = '<td style="border-bottom-style: solid; border-bottom: .5px solid black;">'
-    position = html.rfind(f'<td>{search_term}')
-    parsed = html[:position] + \
-        html[position:].replace('<td>', border, td_count)
-    return parsed
+    if is_float_column(values):
+        values = [np.nan if value is None else float(value) for value in values]
+        decimals = 1
+        for value in values:
+            if np.isfinite(value):
+                text = repr(value)
+                if 'e' not in text:
+                    decimals = max(decimals, min(len(text.split('.')[1]), 6))
+        return ['NaN' if np.isnan(value) else f'{value:.{decimals}f}'
+                for value in values]
+    return [html.escape(str(value)) for value in values]
 
 
-def ref_html_gen(workout_df):
+def write_table(out, table, border_terms=None, columns=None):
     '''
-    Creates reference workout and converts it to an 
-    html string
+    Streams a table to a file handle as an html table
+    with bootstrap formatting
 
     Parameters
     ----------
-    workout_df: obj, pandas df
+    out: obj, file-like
+        anything with a `write` method
+    table: obj, pandas df or list of records
+        see `functions.record_funcs.table_rows`
+    border_terms: list of str, optional
+        values of the first column - the last row of each gets
+        a bottom border to separate the row groups
+    columns: list of str, optional
+        columns to write - needed for an empty list of records
+    '''
+    columns, rows = table_rows(table, columns)
+    formatted = [format_column(list(values)) for values in zip(*rows)]
+    if len(formatted) == 0:
+        formatted = [[] for col in columns]
+    border_rows = set()
+    if border_terms is not None and len(formatted) > 0:
+        last = {value: i for i, value in enumerate(formatted[0])}
+        border_rows = {last[term] for term in border_terms if term in last}
 
-    Returns
-    -------
-    ref_html: str
+    out.write(f'<table border="1" class="dataframe {" ".join(table_classes)}">\n')
+    out.write('  <thead>\n    <tr style="text-align: right;">\n')
+    for col in columns:
+        out.write(f'      <th class="text-center">{html.escape(str(col))}</th>\n')
+    out.write('    </tr>\n  </thead>\n  <tbody>\n')
+    for i, row in enumerate(zip(*formatted)):
+        td = border_td if i in border_rows else '<td>'
+        out.write('    <tr>\n')
+        for value in row:
+            out.write(f'      {td}{value}</td>\n')
+        out.write('    </tr>\n')
+    out.write('  </tbody>\n</table>')
 
-    Notes
-    -----
-    should probably seperate the df generation...
+
+def html_wrap(df, columns=None):
     '''
-    ref = reference_gen(workout_df)
-    ref_html = html_wrap(ref)
-    for workout in ['squat', 'deadlift', 'ohp', 'bench']:
-        ref_html = border_apply(ref_html, workout, ref.shape[1])
+    Converts a pandas dataframe or a list of records to an
+    html string with bootstrap formatting
 
-    return ref_html
+    Parameters
+    ----------
+    df: obj, pandas df or list of records
+    columns: list of str, optional
 
+    Returns
+    -------
+    html: str
+    '''
+    out = io.StringIO()
+    write_table(out, df, columns=columns)
+    return out.getvalue()
 
-def accessory_html_gen(accessory):
+
+def ref_html_gen(workout_df, reference=None):
     '''
-    Converts accessory worokout to html string
+    Creates reference workout and converts it to an 
+    html string
 
     Parameters
     ----------
-    accessory: obj, pandas df
+    workout_df: obj, pandas df or list of WorkoutSet
+    reference: list of ReferenceSet, optional
+        precomputed reference, e.g. from the stored plan - worked
+        out from `workout_df` if not given
 
     Returns
     -------
-    accessory_html: str
+    ref_html: str
     '''
-    accessory_html = html_wrap(accessory)
-    for workout in ['squat', 'deadlift', 'ohp', 'bench']:
-        accessory_html = border_apply(
-            accessory_html, workout, accessory.shape[1])
-
-    return accessory_html
+    if reference is None:
+        reference = reference_sets(workout_df)
+    out = io.StringIO()
+    write_table(out, reference, border_terms, ReferenceSet.__slots__)
+    return out.getvalue()
 
 
-def full_html(orm_html, workout_html, ref_html, accessory_html, week, start, end, style=default_style):
+def accessory_html_gen(accessory):
     '''
-    Generates full html with input of the individual html string and date inputs
+    Converts accessory worokout to html string
 
     Parameters
     ----------
-    orm_html: str
-    workout_html: str
-    ref_html: str
-    accessory_html: str
-    week: str
-    start: str
-    end: str
-    style: str
+    accessory: obj, pandas df or list of AccessoryLift
 
     Returns
     -------
-    html: str
+    accessory_html: str
     '''
-    html = f'''\
+    out = io.StringIO()
+    write_table(out, accessory, border_terms, AccessoryLift.__slots__)
+    return out.getvalue()
+
+
+page_template = '''\
     <!doctype html>
     <html>
       <style>
-      {style}
+      $style
       </style>
       <head> 
       <title> 5-3-1 Workout of the Week </title>
@@ -133,22 +181,119 @@ def full_html(orm_html, workout_html, ref_html, accessory_html, week, start, end
       </head>
       <body style="float: left; padding-left: 15px; padding-right: 15px; overflow-x: hidden">
       <h2>5-3-1 Workout of the Week</h2>
-        <p>PFA - the workout of the week. It is currently <b>Week {week}</b> <br>
-           <b>Week {week}</b> goes from {start} till {end}
+        <p>PFA - the workout of the week. It is currently <b>Week $week</b> <br>
+           <b>Week $week</b> goes from $start till $end
         </p>
         <h4>One Rep Maxes:</h4>
-        {orm_html}
+        $orm_html
+        <br>
+        <h4>One Rep Max Progression:</h4>
+        $chart_html
         <br>
         <h4>Main Workout:</h4>
-        {workout_html}
+        $workout_html
         <br>
         <h4>Weight References:</h4>
-        {ref_html}
+        $ref_html
         <br>
         <h4>Accessory Exercises:</h4>
-        {accessory_html}
+        $accessory_html
         <br>
       </body>
     </html>
     '''
-    return html
+
+# precompiled once - literal Templates alternate with the table placeholders
+page_segments = [Template(segment) if i % 2 == 0 else segment for i, segment in
+                 enumerate(re.split(r'\$(orm_html|chart_html|workout_html|ref_html|accessory_html)',
+                                    page_template))]
+
+
+def write_page(out, tables, week, start, end, style=default_style):
+    '''
+    Streams the full html page to a file handle
+
+    Parameters
+    ----------
+    out: obj, file-like
+        anything with a `write` method
+    tables: obj, dict
+        maps `orm_html`, `chart_html`, `workout_html`, `ref_html` and
+        `accessory_html` to either an html string or a callable that
+        writes the table to `out` - missing sections are left empty
+    week: str
+    start: str
+    end: str
+    style: str
+    '''
+    values = {'week': week, 'start': start, 'end': end, 'style': style}
+    for segment in page_segments:
+        if isinstance(segment, Template):
+            out.write(segment.substitute(values))
+        elif callable(tables.get(segment)):
+            tables[segment](out)
+        else:
+            out.write(tables.get(segment, ''))
+
+
+def write_report(out, orm, workout, accessory, week, start, end, style=default_style,
+                 chart_html='', reference=None):
+    '''
+    Renders the workout report straight from the records to a file
+    handle in one pass
+
+    Parameters
+    ----------
+    out: obj, file-like
+        anything with a `write` method
+    orm: obj, pandas df or list of dict
+        one rep max of each lift
+    workout: obj, pandas df or list of WorkoutSet
+    accessory: obj, pandas df or list of AccessoryLift
+    week: str
+    start: str
+    end: str
+    style: str
+    chart_html: str
+        inline svg of the orm progression
+    reference: list of ReferenceSet, optional
+        see `ref_html_gen`
+    '''
+    if reference is None:
+        reference = reference_sets(workout)
+    tables = {'orm_html': lambda f: write_table(f, orm, columns=lifts),
+              'chart_html': chart_html,
+              'workout_html': lambda f: write_table(f, workout, columns=WorkoutSet.__slots__),
+              'ref_html': lambda f: write_table(f, reference, border_terms,
+                                                ReferenceSet.__slots__),
+              'accessory_html': lambda f: write_table(f, accessory, border_terms,
+                                                      AccessoryLift.__slots__)}
+    write_page(out, tables, week, start, end, style)
+
+
+def full_html(orm_html, workout_html, ref_html, accessory_html, week, start, end, style=default_style,
+              chart_html=''):
+    '''
+    Generates full html with input of the individual html string and date inputs
+
+    Parameters
+    ----------
+    orm_html: str
+    workout_html: str
+    ref_html: str
+    accessory_html: str
+    week: str
+    start: str
+    end: str
+    style: str
+    chart_html: str
+
+    Returns
+    -------
+    html: str
+    '''
+    out = io.StringIO()
+    tables = {'orm_html': orm_html, 'chart_html': chart_html, 'workout_html': workout_html,
+              'ref_html': ref_html, 'accessory_html': accessory_html}
+    write_page(out, tables, week, start, end, style)
+    return out.getvalue()
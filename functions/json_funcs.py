@@ -0,0 +1,116 @@
+'''functions for encoding and decoding JSON database columns'''
+
+import ast
+import json
+from functools import lru_cache
+
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(raw):
+    '''
+    Parses a JSON string with orjson if it is installed,
+    else the standard library
+
+    Parameters
+    ----------
+    raw: str
+
+    Returns
+    -------
+    obj, varying
+    '''
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+@lru_cache(maxsize=2**16)
+def cached_decode(raw):
+    '''
+    Decodes a JSON column value, caching the result by the raw string
+
+    Notes
+    -----
+    Falls back to `ast.literal_eval` for values stored as python
+    literals by older versions of the tool
+    '''
+    try:
+        return loads(raw)
+    except ValueError:
+        return ast.literal_eval(raw)
+
+
+def decode(raw):
+    '''
+    Decodes one JSON column value to a dictionary
+
+    Parameters
+    ----------
+    raw: str
+
+    Returns
+    -------
+    obj, dict
+        a copy, so the cached value is never modified
+    '''
+    return dict(cached_decode(raw))
+
+
+def encode(obj):
+    '''
+    Encodes a dictionary for a JSON column
+
+    Parameters
+    ----------
+    obj: obj, dict
+
+    Returns
+    -------
+    str
+    '''
+    return json.dumps(obj)
+
+
+def decode_column(series):
+    '''
+    Decodes a whole JSON column, parsing each distinct value once
+
+    Parameters
+    ----------
+    series: obj, pandas series
+        raw JSON strings
+
+    Returns
+    -------
+    obj, pandas series
+        decoded dictionaries
+    '''
+    decoded = {raw: cached_decode(raw) for raw in series.unique()}
+    return series.map(lambda raw: dict(decoded[raw]))
+
+
+def explode_column(df, json_col):
+    '''
+    Expands a JSON column of dictionaries into one
+    column per key
+
+    Parameters
+    ----------
+    df: obj, pandas df
+    json_col: str
+
+    Returns
+    -------
+    obj, pandas df
+        df with `json_col` replaced by its keys
+    '''
+    decoded = {raw: cached_decode(raw) for raw in df[json_col].unique()}
+    keys = pd.DataFrame.from_records([decoded[raw] for raw in df[json_col]],
+                                     index=df.index)
+    return df.drop(columns=json_col).join(keys)
@@ -0,0 +1,182 @@
+'''functions for configuring the workout logger'''
+
+import atexit
+import logging
+import os
+import queue
+import sys
+from logging import Formatter, StreamHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+logger_name = 'workout_logger'
+
+# child loggers of workout_logger, each with its own level
+subsystems = ['db', 'schema', 'metrics', 'report', 'export', 'serve', 'mail']
+
+_handlers = []
+_listener = None
+
+
+def get_logger(name=None):
+    '''
+    Gets the workout logger or one of its subsystem loggers
+
+    Parameters
+    ----------
+    name: str, optional
+        subsystem, e.g. `db` for `workout_logger.db`
+
+    Returns
+    -------
+    logger: obj, logging.Logger
+        records propagate to `workout_logger`, which is set
+        up by `configure_logging`
+    '''
+    if name is None:
+        return logging.getLogger(logger_name)
+    return logging.getLogger(f'{logger_name}.{name}')
+
+
+def parse_levels(spec):
+    '''
+    Parses a level spec such as "INFO,db=WARNING,metrics=DEBUG"
+
+    Parameters
+    ----------
+    spec: str
+        comma separated levels - a bare level applies to
+        workout_logger, `subsystem=level` to one subsystem
+
+    Returns
+    -------
+    levels: obj, dict
+        {subsystem: level} - None is the key for workout_logger
+    '''
+    levels = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        name, _, level = item.rpartition('=')
+        levels[name if name != '' else None] = level.strip().upper()
+    return levels
+
+
+def set_levels(levels):
+    '''
+    Sets the level of workout_logger and its subsystems
+
+    Parameters
+    ----------
+    levels: obj, dict or str
+        {subsystem: level}, None for workout_logger - or
+        a spec for `parse_levels`
+    '''
+    if isinstance(levels, str):
+        levels = parse_levels(levels)
+    for name, level in levels.items():
+        get_logger(name).setLevel(level)
+
+
+def configure_logging(log_dir='.', level=None, levels=None):
+    '''
+    Sends workout_logger records through a queue to a listener
+    thread that writes them to stdout and `workout.log`, so
+    logging never blocks on disk io
+
+    Parameters
+    ----------
+    log_dir: str
+        directory of `workout.log`
+    level: int or str, optional
+        level of workout_logger - INFO unless set
+    levels: obj, dict or str, optional
+        subsystem levels, see `set_levels` - the `WORKOUT_LOG_LEVELS`
+        environment variable is applied first
+
+    Notes
+    -----
+    Safe to call more than once - the handlers and the listener are only
+    set up on the first call, later calls just update the levels
+    '''
+    global _listener
+    root = get_logger()
+    if _listener is None:
+        formatter = Formatter('%(asctime)s | %(levelname)s | %(message)s')
+        sh = StreamHandler(stream=sys.stdout)
+        sh.setFormatter(formatter)
+        fh = RotatingFileHandler(
+            os.path.join(log_dir, 'workout.log'), maxBytes=10*1024*1024, backupCount=0)
+        fh.setFormatter(formatter)
+        _handlers[:] = [sh, fh]
+        log_queue = queue.SimpleQueue()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(QueueHandler(log_queue))
+        _listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+    if level is not None:
+        root.setLevel(level)
+    elif root.level == logging.NOTSET:
+        root.setLevel(logging.INFO)
+    set_levels(os.environ.get('WORKOUT_LOG_LEVELS', ''))
+    if levels is not None:
+        set_levels(levels)
+    return root
+
+
+def stop_logging():
+    '''
+    Flushes the queued records and stops the listener thread
+    '''
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def start_process_logging():
+    '''
+    Starts a listener for records sent by other processes - pass
+    the queue to `configure_worker_logging` in each of them
+
+    Returns
+    -------
+    log_queue: obj, multiprocessing.Queue
+    listener: obj, logging.handlers.QueueListener
+        stop it once the processes have finished
+
+    Notes
+    -----
+    Records from every process are written by the same handlers,
+    so lines from different processes never interleave
+    '''
+    import multiprocessing
+
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    listener.start()
+    return log_queue, listener
+
+
+def configure_worker_logging(log_queue, levels=None):
+    '''
+    Sends this process's workout_logger records to the
+    parent process through `log_queue`
+
+    Parameters
+    ----------
+    log_queue: obj, multiprocessing.Queue
+        from `start_process_logging`
+    levels: obj, dict or str, optional
+        see `set_levels`
+    '''
+    stop_logging()
+    root = get_logger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    if levels is not None:
+        set_levels(levels)
+    return root
@@ -0,0 +1,365 @@
+'''functions for emailing the weekly workout reports'''
+
+import asyncio
+import os
+import smtplib
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+
+import pandas as pd
+
+from functions.db_funcs import LOCAL_DIR, read_sql, table_overwrite
+from functions.dt_funcs import now, week_number
+from functions.log_funcs import get_logger
+from functions.metrics_funcs import timed
+from functions.record_funcs import Delivery
+
+logger = get_logger('mail')
+
+delivery_keys = ['user_id', 'week_start']
+
+subject = '5-3-1 Workout of the Week'
+body = 'PFA - the workout of the week.'
+
+
+def smtp_settings(environ=None):
+    '''
+    Reads the smtp settings from `WORKOUT_SMTP_*` environment variables
+
+    Parameters
+    ----------
+    environ: obj, dict, optional
+        defaults to `os.environ`
+
+    Returns
+    -------
+    settings: obj, dict
+        kwargs for `send_reports` - `host` (WORKOUT_SMTP_HOST, localhost),
+        `port` (WORKOUT_SMTP_PORT, 25), `sender` (WORKOUT_SMTP_SENDER),
+        `user` and `password` (WORKOUT_SMTP_USER, WORKOUT_SMTP_PASSWORD)
+        and `starttls` (WORKOUT_SMTP_STARTTLS set to 1)
+    '''
+    if environ is None:
+        environ = os.environ
+    return {'host': environ.get('WORKOUT_SMTP_HOST', 'localhost'),
+            'port': int(environ.get('WORKOUT_SMTP_PORT', 25)),
+            'sender': environ.get('WORKOUT_SMTP_SENDER', 'workouts@localhost'),
+            'user': environ.get('WORKOUT_SMTP_USER'),
+            'password': environ.get('WORKOUT_SMTP_PASSWORD'),
+            'starttls': environ.get('WORKOUT_SMTP_STARTTLS') == '1'}
+
+
+def delivery_jobs(con, file='lp-workout.html', out_dir=LOCAL_DIR, users=None, dt=None):
+    '''
+    Lists the reports of active users that have not been
+    sent for the current week
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    file: str
+        report file name, as passed to `WorkoutMaker.run`
+    out_dir: str
+        directory the reports are written to
+    users: list of str, optional
+        only send to these user names, e.g. the users
+        whose report built successfully
+    dt: timestamp, optional
+        defaults to today
+
+    Returns
+    -------
+    list of Delivery
+        with `status` pending
+    '''
+    if dt is None:
+        dt = now(date=True)
+    s = '''
+    SELECT u.user_id, u.user_name, u.email, o.data_start_date, o.data_end_date
+    FROM dim_user u
+    INNER JOIN pause_workout p USING (user_id)
+    INNER JOIN one_rep_max o USING (user_id)
+    WHERE p.pause_flag = "False"
+    AND o.data_start_date <= ?
+    AND o.data_end_date >= ?
+    ORDER BY u.user_id, o.data_start_date
+    '''
+    months = read_sql(s, con, params=[dt, dt]).drop_duplicates('user_id')
+    if users is not None:
+        months = months[months['user_name'].isin(users)]
+    week = week_number(months['data_start_date'], months['data_end_date'], [dt] * months.shape[0])
+    week_start = pd.to_datetime(months['data_start_date']) + pd.to_timedelta((week - 1) * 7, unit='D')
+    sent = read_sql('SELECT user_id, week_start FROM email_delivery WHERE status = "sent"', con)
+    sent = set(zip(sent['user_id'], pd.to_datetime(sent['week_start'])))
+    jobs = []
+    for user_id, user, email, start in zip(months['user_id'], months['user_name'],
+                                           months['email'], week_start):
+        if (user_id, start) in sent:
+            continue
+        email = None if pd.isnull(email) else email
+        jobs.append(Delivery(int(user_id), start, email,
+                             os.path.join(out_dir, f'{user}-{file}'), 'pending', 0, None, None))
+    return jobs
+
+
+def build_message(delivery, sender):
+    '''
+    Builds the email of one report, with the report attached
+
+    Parameters
+    ----------
+    delivery: obj, Delivery
+    sender: str
+        from address
+
+    Returns
+    -------
+    obj, email.message.EmailMessage
+    '''
+    message = EmailMessage()
+    message['Subject'] = f'{subject} - week of {delivery.week_start:%Y-%m-%d}'
+    message['From'] = sender
+    message['To'] = delivery.email
+    message.set_content(body)
+    with open(delivery.file, 'rb') as f:
+        message.add_attachment(f.read(), maintype='text', subtype='html',
+                               filename=os.path.basename(delivery.file))
+    return message
+
+
+def is_permanent(error):
+    '''
+    Checks if a failed send should not be retried - 5xx replies,
+    recipients refused with 5xx replies and missing reports
+    '''
+    if isinstance(error, FileNotFoundError):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return getattr(error, 'smtp_code', 0) >= 500
+
+
+class SmtpSender(object):
+    '''
+    One smtp connection, opened on first use and kept
+    open for every message sent through it
+
+    Parameters
+    ----------
+    host: str
+    port: int
+    sender: str
+        from address
+    user: str, optional
+    password: str, optional
+    starttls: bool
+    timeout: float
+        seconds
+
+    Notes
+    -----
+    Not thread safe - each `dispatch` worker owns one sender
+    and only runs one call on it at a time
+    '''
+
+    def __init__(self, host='localhost', port=25, sender='workouts@localhost', user=None,
+                 password=None, starttls=False, timeout=30):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.smtp = None
+
+    def connect(self):
+        '''
+        Opens the connection, logging in if a user is set
+        '''
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls == True:
+            smtp.starttls()
+        if self.user is not None:
+            smtp.login(self.user, self.password)
+        self.smtp = smtp
+
+    def send(self, delivery):
+        '''
+        Builds and sends the email of one report
+        '''
+        message = build_message(delivery, self.sender)
+        if self.smtp is None:
+            self.connect()
+        self.smtp.send_message(message)
+
+    def reset(self):
+        '''
+        Drops a connection that may be broken, so the
+        next send reconnects
+        '''
+        if self.smtp is not None:
+            try:
+                self.smtp.close()
+            finally:
+                self.smtp = None
+
+    def close(self):
+        '''
+        Ends the smtp session
+        '''
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            finally:
+                self.reset()
+
+
+async def deliver(sender, delivery, executor, retries=3, backoff=1.0):
+    '''
+    Sends one report, retrying transient failures - any other
+    error fails the delivery without affecting the rest
+
+    Parameters
+    ----------
+    sender: obj, SmtpSender
+    delivery: obj, Delivery
+        updated with the outcome
+    executor: obj, concurrent.futures.Executor
+        blocking smtp calls are run in it
+    retries: int
+        retries after the first attempt
+    backoff: float
+        seconds before the first retry, doubled for each one after
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        delivery.attempts += 1
+        try:
+            await loop.run_in_executor(executor, sender.send, delivery)
+        except (smtplib.SMTPException, OSError) as e:
+            delivery.error = f'{type(e).__name__}: {e}'
+            if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException,
+                                  FileNotFoundError)):
+                # anything but a reply may have left the connection unusable
+                await loop.run_in_executor(executor, sender.reset)
+            if is_permanent(e) or delivery.attempts > retries:
+                delivery.status = 'failed'
+                return delivery
+            await asyncio.sleep(backoff * 2 ** (delivery.attempts - 1))
+        except Exception as e:
+            # e.g. a malformed address - retrying would not help, but the
+            # other deliveries must still go out and be recorded
+            delivery.error = f'{type(e).__name__}: {e}'
+            delivery.status = 'failed'
+            await loop.run_in_executor(executor, sender.reset)
+            return delivery
+        else:
+            delivery.status = 'sent'
+            delivery.error = None
+            delivery.sent_time = now(date=False)
+            return delivery
+
+
+async def dispatch(deliveries, connections=4, retries=3, backoff=1.0, **smtp):
+    '''
+    Sends many reports over a few reused smtp connections
+
+    Parameters
+    ----------
+    deliveries: list of Delivery
+    connections: int
+        number of smtp connections - at most this many
+        messages are in flight at once
+    retries: int
+        see `deliver`
+    backoff: float
+        see `deliver`
+    **smtp
+        kwargs for `SmtpSender`
+
+    Returns
+    -------
+    list of Delivery
+        updated with the outcome of each send
+    '''
+    queue = asyncio.Queue()
+    for delivery in deliveries:
+        queue.put_nowait(delivery)
+    loop = asyncio.get_running_loop()
+
+    async def worker(executor):
+        sender = SmtpSender(**smtp)
+        try:
+            while not queue.empty():
+                await deliver(sender, queue.get_nowait(), executor, retries, backoff)
+        finally:
+            await loop.run_in_executor(executor, sender.close)
+
+    workers = max(1, min(connections, len(deliveries)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        await asyncio.gather(*[worker(executor) for _ in range(workers)])
+    return deliveries
+
+
+@timed()
+def send_reports(con, file='lp-workout.html', out_dir=LOCAL_DIR, users=None, connections=4,
+                 retries=3, backoff=1.0, **smtp):
+    '''
+    Emails this week's report to every active user it
+    has not been sent to yet, and records the outcome in
+    email_delivery
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    file: str
+        report file name
+    out_dir: str
+        directory the reports are written to
+    users: list of str, optional
+        see `delivery_jobs`
+    connections: int
+        see `dispatch`
+    retries: int
+        see `deliver`
+    backoff: float
+        see `deliver`
+    **smtp
+        kwargs for `SmtpSender` - see `smtp_settings`
+
+    Returns
+    -------
+    deliveries: list of Delivery
+
+    Notes
+    -----
+    * Failed deliveries are picked up again by the next run of the
+    week, as only sent reports are skipped
+    * Outcomes are recorded even if the dispatch is interrupted, so
+    reports already sent are not sent again
+    '''
+    deliveries = delivery_jobs(con, file, out_dir, users)
+    missing = [delivery for delivery in deliveries if not delivery.email]
+    for delivery in missing:
+        delivery.status = 'skipped'
+        delivery.error = 'no email address'
+    pending = [delivery for delivery in deliveries if delivery.email]
+    start = time.perf_counter()
+    try:
+        asyncio.run(dispatch(pending, connections, retries, backoff, **smtp))
+    finally:
+        if len(deliveries) > 0:
+            table_overwrite('email_delivery', deliveries, delivery_keys, con)
+    counts = Counter(delivery.status for delivery in deliveries)
+    logger.info('%s reports sent, %s failed, %s skipped in %.2fs', counts['sent'],
+                counts['failed'], counts['skipped'], time.perf_counter() - start)
+    for delivery in deliveries:
+        if delivery.status == 'failed':
+            logger.warning('report to %s failed after %s attempt(s) - %s', delivery.email,
+                           delivery.attempts, delivery.error)
+    return deliveries
@@ -0,0 +1,223 @@
+'''functions for timing pipeline stages and counting database work per user'''
+
+import contextvars
+import datetime
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from functions.log_funcs import get_logger
+
+logger = get_logger('metrics')
+
+_current_user = contextvars.ContextVar('metrics_user', default=None)
+
+
+class Metrics(object):
+    '''
+    Collects stage timings and sql counters, keyed by the
+    user whose workout is being built
+
+    Notes
+    -----
+    Work done outside of `user_scope` (e.g. `load_context`) is
+    recorded under the user None
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Drops everything recorded so far
+        '''
+        with self._lock:
+            self.users = {}
+            self.start_time = time.perf_counter()
+
+    def record(self, user=None):
+        '''
+        Gets the record of a user, defaulting to the current one
+
+        Returns
+        -------
+        record: obj, dict
+            `seconds` in `user_scope`, `queries`, `rows_read`, `rows_written`
+            and `stages` - {stage: [calls, seconds]}
+        '''
+        user = _current_user.get() if user is None else user
+        if user not in self.users:
+            self.users[user] = {'user': user, 'seconds': 0.0, 'queries': 0,
+                                'rows_read': 0, 'rows_written': 0, 'stages': {}}
+        return self.users[user]
+
+    def add(self, counter, n=1):
+        '''
+        Adds `n` to a counter of the current user
+        '''
+        with self._lock:
+            self.record()[counter] += n
+
+    def add_time(self, stage, seconds):
+        '''
+        Adds one call of `stage` taking `seconds` to the current user
+        '''
+        with self._lock:
+            stages = self.record()['stages']
+            calls, total = stages.get(stage, [0, 0.0])
+            stages[stage] = [calls + 1, total + seconds]
+
+    @contextmanager
+    def user_scope(self, user, con=None):
+        '''
+        Attributes everything recorded inside the block to `user`
+
+        Parameters
+        ----------
+        user: str
+        con: sqlite3.Connection, optional
+            rows written are counted from its `total_changes`
+        '''
+        token = _current_user.set(user)
+        changes = con.total_changes if con is not None else 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                record = self.record(user)
+                record['seconds'] += time.perf_counter() - start
+                if con is not None:
+                    record['rows_written'] += con.total_changes - changes
+            _current_user.reset(token)
+
+    def merge(self, record):
+        '''
+        Adds a user record collected in another process
+        '''
+        with self._lock:
+            target = self.record(record['user'])
+            for counter in ['seconds', 'queries', 'rows_read', 'rows_written']:
+                target[counter] += record[counter]
+            for stage, (calls, total) in record['stages'].items():
+                current = target['stages'].get(stage, [0, 0.0])
+                target['stages'][stage] = [current[0] + calls, current[1] + total]
+
+    def summary(self):
+        '''
+        Totals every user record
+
+        Returns
+        -------
+        summary: obj, dict
+            run `seconds`, number of `users`, the counters summed over all
+            users and `stages` - {stage: {calls, seconds}} slowest first
+        '''
+        with self._lock:
+            records = list(self.users.values())
+            summary = {'seconds': round(time.perf_counter() - self.start_time, 4),
+                       'users': len([record for record in records if record['user'] is not None])}
+            for counter in ['queries', 'rows_read', 'rows_written']:
+                summary[counter] = sum(record[counter] for record in records)
+            stages = {}
+            for record in records:
+                for stage, (calls, total) in record['stages'].items():
+                    current = stages.get(stage, [0, 0.0])
+                    stages[stage] = [current[0] + calls, current[1] + total]
+        summary['stages'] = {stage: {'calls': calls, 'seconds': round(total, 4)}
+                             for stage, (calls, total) in
+                             sorted(stages.items(), key=lambda item: -item[1][1])}
+        return summary
+
+    def log_summary(self, path=None, slowest=5):
+        '''
+        Logs the end of run summary and the slowest users
+
+        Parameters
+        ----------
+        path: str, optional
+            if set, every user record and the summary are
+            appended to this file as json lines
+        slowest: int
+            number of slowest users to log
+        '''
+        summary = self.summary()
+        logger.info('run finished - %s users in %.2fs, %s queries, %s rows read, %s rows written',
+                    summary['users'], summary['seconds'], summary['queries'],
+                    summary['rows_read'], summary['rows_written'])
+        for stage, stats in summary['stages'].items():
+            logger.info('stage %s - %s calls, %.3fs', stage, stats['calls'], stats['seconds'])
+        users = sorted([record for record in self.users.values() if record['user'] is not None],
+                       key=lambda record: -record['seconds'])
+        for record in users[:slowest]:
+            logger.info('slow user %s - %.3fs, %s queries', record['user'],
+                        record['seconds'], record['queries'])
+        if path is not None:
+            run_time = str(datetime.datetime.now())
+            with open(path, 'a') as f:
+                for record in self.users.values():
+                    f.write(json.dumps(dict(record, type='user', run_time=run_time)) + '\n')
+                f.write(json.dumps(dict(summary, type='summary', run_time=run_time)) + '\n')
+        return summary
+
+
+metrics = Metrics()
+
+
+class timed(object):
+    '''
+    Times a block or every call of a function as a stage of
+    the current user
+
+    Parameters
+    ----------
+    stage: str, optional
+        stage name - defaults to the qualified name of
+        the decorated function
+
+    Examples
+    --------
+    >>> @timed()
+    ... def create_workout_df(self): ...
+    >>> with timed('write'):
+    ...     f.write(html)
+    '''
+
+    def __init__(self, stage=None):
+        self.stage = stage
+
+    def __call__(self, fn):
+        stage = self.stage if self.stage is not None else fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.add_time(stage, time.perf_counter() - start)
+        return wrapper
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        metrics.add_time(self.stage, time.perf_counter() - self._start)
+        return False
+
+
+def instrument(con):
+    '''
+    Counts every sql statement run on `con` towards the
+    current user's `queries`
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    '''
+    con.set_trace_callback(lambda statement: metrics.add('queries'))
+    return con
@@ -0,0 +1,107 @@
+'''functions for materializing and reading back the monthly workout plan'''
+
+from functions.plate_funcs import format_loading, get_calculator
+from functions.record_funcs import PlanRow, ReferenceSet, WorkoutSet
+from functions.workout_funcs import (lifts, orm_array, week_numbers, week_reps,
+                                     workout_weights)
+
+plan_keys = ['user_id', 'data_start_date', 'week', 'set_number', 'lift']
+
+
+def plan_rows(entries, calculator=None):
+    '''
+    Works out the full plan of one or more one_rep_max months -
+    every set of every lift of every week
+
+    Parameters
+    ----------
+    entries: list of OrmEntry
+    calculator: obj, PlateCalculator, optional
+        defaults to `functions.plate_funcs.default_plates` on a 45lb bar
+
+    Returns
+    -------
+    list of PlanRow
+
+    Notes
+    -----
+    Plates are picked per lift and week, the same session
+    `reference_sets` minimizes plate changes over in a report
+    '''
+    if calculator is None:
+        calculator = get_calculator()
+    if len(entries) == 0:
+        return []
+    weights = workout_weights(orm_array([entry.weights for entry in entries])).tolist()
+    reps = week_reps.tolist()
+    # the same session of weights comes up for many users and months
+    sessions = {}
+    rows = []
+    for entry, entry_weights in zip(entries, weights):
+        for ix, week in enumerate(week_numbers):
+            for l, lift in enumerate(lifts):
+                session = tuple(set_weights[l] for set_weights in entry_weights[ix])
+                if session not in sessions:
+                    sessions[session] = [format_loading(stack) for stack in
+                                         calculator.session_loadings(list(session))]
+                for s, (weight, plates) in enumerate(zip(session, sessions[session])):
+                    rows.append(PlanRow(entry.user_id, entry.data_start_date, week, s + 1,
+                                        lift, weight, reps[ix][s], plates))
+    return rows
+
+
+def plan_workout_sets(rows):
+    '''
+    Pivots plan rows back into the sets of the main workout
+
+    Parameters
+    ----------
+    rows: list of PlanRow
+        the plan of one month, for the weeks to show
+
+    Returns
+    -------
+    list of WorkoutSet
+        numbered across all weeks, as `get_workout_sets` does
+    '''
+    sets = {}
+    for row in rows:
+        key = (row.week, row.set_number)
+        if key not in sets:
+            sets[key] = WorkoutSet(row.week, 0, row.reps)
+        setattr(sets[key], row.lift, row.weight)
+    workout = [sets[key] for key in sorted(sets)]
+    for number, workout_set in enumerate(workout):
+        workout_set.set = number + 1
+    return workout
+
+
+def plan_reference_sets(rows, bar=None):
+    '''
+    Builds the weight reference from plan rows, with
+    the plates that were stored
+
+    Parameters
+    ----------
+    rows: list of PlanRow
+        the plan of one month, for the weeks to show
+    bar: float, optional
+        bar weight - defaults to the default calculator's
+
+    Returns
+    -------
+    list of ReferenceSet
+        same as `reference_sets` on the matching workout
+        of a single week
+    '''
+    if bar is None:
+        bar = get_calculator().bar
+    numbers = {key: number + 1 for number, key in
+               enumerate(sorted({(row.week, row.set_number) for row in rows}))}
+    order = {lift: i for i, lift in enumerate(lifts)}
+    ref = []
+    for row in sorted(rows, key=lambda row: (order[row.lift], row.week, row.set_number)):
+        weight_no_bar = row.weight - bar
+        ref.append(ReferenceSet(row.lift, numbers[(row.week, row.set_number)], row.reps,
+                                row.weight, weight_no_bar, -(weight_no_bar // -2), row.plates))
+    return ref
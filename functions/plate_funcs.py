@@ -0,0 +1,219 @@
+'''functions for working out which plates to load on each side of the bar'''
+
+from functools import lru_cache
+
+# plates available for each side of the bar, {plate weight: count}
+default_plates = {45: 8, 35: 1, 25: 1, 10: 2, 5: 1, 2.5: 1}
+default_bar = 45
+
+
+def plate_scale(plates):
+    '''
+    Gets the smallest multiplier that turns every plate
+    weight into a whole number
+
+    Parameters
+    ----------
+    plates: iterable of float
+
+    Returns
+    -------
+    scale: int
+    '''
+    for scale in [1, 2, 4, 10, 20, 100]:
+        if all(abs(plate * scale - round(plate * scale)) < 1e-9 for plate in plates):
+            return scale
+    raise ValueError('plate weights must be multiples of 0.01')
+
+
+def change_cost(current, new):
+    '''
+    Counts the plates moved on one side of the bar to go from
+    one loading to another
+
+    Parameters
+    ----------
+    current: tuple of float
+        plates heaviest first, as they are stacked on the bar
+    new: tuple of float
+
+    Returns
+    -------
+    int
+        plates taken off plus plates put on
+
+    Notes
+    -----
+    Plates are stacked heaviest first, so everything outside the shared
+    inner stack has to come off
+    '''
+    shared = 0
+    for a, b in zip(current, new):
+        if a != b:
+            break
+        shared += 1
+    return len(current) + len(new) - 2 * shared
+
+
+class PlateCalculator(object):
+    '''
+    Precomputes plate loadings for every weight reachable
+    with a plate inventory, so lookups are O(1)
+
+    Parameters
+    ----------
+    plates: obj, dict
+        {plate weight: count available for each side}
+    bar: float
+        bar weight
+    slack: int
+        loadings using up to this many plates more than the fewest
+        possible are kept as candidates for minimizing plate changes
+    '''
+
+    def __init__(self, plates=default_plates, bar=default_bar, slack=2):
+        assert all(count >= 0 for count in plates.values()), 'plate counts must be positive'
+        self.plates = sorted([plate for plate in plates if plates[plate] > 0], reverse=True)
+        self.bar = bar
+        self.scale = plate_scale(self.plates + [bar])
+        units = {plate: int(round(plate * self.scale)) for plate in self.plates}
+
+        # loadings[w] - candidate stacks for w units on each side,
+        # fewest plates first and heavier plates first among ties
+        loadings = {0: [()]}
+        for plate in self.plates:
+            updated = {}
+            for total, stacks in loadings.items():
+                for count in range(plates[plate] + 1):
+                    key = total + count * units[plate]
+                    updated.setdefault(key, []).extend(
+                        stack + (plate,) * count for stack in stacks)
+            for total, stacks in updated.items():
+                fewest = min(len(stack) for stack in stacks)
+                updated[total] = [stack for stack in stacks if len(stack) <= fewest + slack]
+            loadings = updated
+        for total in loadings:
+            loadings[total] = sorted(set(loadings[total]),
+                                     key=lambda stack: (len(stack), [-p for p in stack]))
+        self.loadings = loadings
+
+    def side_units(self, weight):
+        '''
+        Converts a total bar weight to integer units per side,
+        None if it can't be split evenly
+        '''
+        units = (weight - self.bar) * self.scale / 2
+        if units < 0 or abs(units - round(units)) > 1e-9:
+            return None
+        return int(round(units))
+
+    def candidates(self, weight):
+        '''
+        Gets every candidate loading for a total bar weight
+
+        Parameters
+        ----------
+        weight: float
+
+        Returns
+        -------
+        list of tuple
+            plates for each side, heaviest first - empty
+            if the weight can't be loaded
+        '''
+        return self.loadings.get(self.side_units(weight), [])
+
+    def loading(self, weight):
+        '''
+        Gets the loading with the fewest plates for a total bar weight
+
+        Parameters
+        ----------
+        weight: float
+
+        Returns
+        -------
+        tuple
+            plates for each side, heaviest first
+        None
+            If the weight can't be loaded with the inventory
+        '''
+        candidates = self.candidates(weight)
+        if len(candidates) == 0:
+            return None
+        return candidates[0]
+
+    def session_loadings(self, weights):
+        '''
+        Picks a loading for each set of a session so the total
+        number of plate changes is as small as possible
+
+        Parameters
+        ----------
+        weights: list of float
+            total bar weight of each set, in the order they are lifted
+
+        Returns
+        -------
+        list of tuple
+            plates for each side of each set - None for sets
+            that can't be loaded
+        '''
+        # Viterbi over the candidate loadings of each set - the state is
+        # (plate changes, plates loaded) so ties go to lighter stacks
+        loaded = [(weight, self.candidates(weight)) for weight in weights]
+        steps = [(i, stacks) for i, (weight, stacks) in enumerate(loaded) if len(stacks) > 0]
+        result = [None] * len(weights)
+        if len(steps) == 0:
+            return result
+
+        costs = [{stack: (len(stack), len(stack)) for stack in steps[0][1]}]
+        back = [{}]
+        for _, stacks in steps[1:]:
+            cost, pointer = {}, {}
+            for stack in stacks:
+                best = min(costs[-1], key=lambda prev: (costs[-1][prev][0] + change_cost(prev, stack),
+                                                       costs[-1][prev][1]))
+                cost[stack] = (costs[-1][best][0] + change_cost(best, stack),
+                               costs[-1][best][1] + len(stack))
+                pointer[stack] = best
+            costs.append(cost)
+            back.append(pointer)
+
+        stack = min(costs[-1], key=lambda stack: costs[-1][stack])
+        for step in range(len(steps) - 1, -1, -1):
+            result[steps[step][0]] = stack
+            if step > 0:
+                stack = back[step][stack]
+        return result
+
+
+@lru_cache(maxsize=None)
+def get_calculator(plates=None, bar=default_bar):
+    '''
+    Gets a cached PlateCalculator
+
+    Parameters
+    ----------
+    plates: tuple of tuple, optional
+        ((plate weight, count), ...) - defaults to `default_plates`
+    bar: float
+
+    Returns
+    -------
+    obj, PlateCalculator
+    '''
+    plates = default_plates if plates is None else dict(plates)
+    return PlateCalculator(plates, bar)
+
+
+def format_loading(stack):
+    '''
+    Formats a loading for display, e.g. "45, 25, 2.5" - empty
+    if the weight can't be loaded
+    '''
+    if stack is None:
+        return ''
+    if len(stack) == 0:
+        return 'bar only'
+    return ', '.join(f'{plate:g}' for plate in stack)
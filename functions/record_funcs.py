@@ -0,0 +1,205 @@
+'''lightweight records for the per-user workout model'''
+
+from functions.json_funcs import decode
+
+
+class Record(object):
+    '''
+    Base class for records - subclasses list their fields,
+    in column order, in `__slots__`
+
+    Parameters
+    ----------
+    *args, **kwargs
+        field values, positionally in `__slots__` order or by name
+    '''
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        assert len(args) <= len(self.__slots__), f'{type(self).__name__} takes {len(self.__slots__)} fields'
+        for field, value in zip(self.__slots__, args):
+            setattr(self, field, value)
+        for field, value in kwargs.items():
+            setattr(self, field, value)
+
+    def values(self):
+        '''
+        Gets the field values in column order
+
+        Returns
+        -------
+        tuple
+        '''
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def to_dict(self):
+        '''
+        Returns
+        -------
+        obj, dict
+            {field: value}
+        '''
+        return dict(zip(self.__slots__, self.values()))
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.values() == other.values()
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+    @classmethod
+    def from_frame(cls, df):
+        '''
+        Converts the rows of a df to records
+
+        Parameters
+        ----------
+        df: obj, pandas df
+            must have a column for every field
+
+        Returns
+        -------
+        list of Record
+        '''
+        return [cls(*row) for row in df[list(cls.__slots__)].itertuples(index=False, name=None)]
+
+
+class OrmEntry(Record):
+    '''
+    One month of one_rep_max
+
+    Notes
+    -----
+    `orm_dict` is kept as the stored JSON string so entries can be
+    written back as is - `weights` decodes it
+    '''
+    __slots__ = ('user_id', 'data_start_date', 'data_end_date', 'orm_dict', 'publish_time')
+
+    @property
+    def weights(self):
+        '''
+        Returns
+        -------
+        obj, dict
+            {lift: one rep max}
+        '''
+        return decode(self.orm_dict)
+
+
+class ProgressionEntry(Record):
+    '''
+    A user's monthly progression, `prog_dict` as a JSON string
+    '''
+    __slots__ = ('user_id', 'prog_dict')
+
+
+class WorkoutSet(Record):
+    '''
+    One set of the main workout, with the weight of every lift
+    '''
+    __slots__ = ('week', 'set', 'reps', 'deadlift', 'squat', 'bench', 'ohp')
+
+
+class ReferenceSet(Record):
+    '''
+    One set of one lift, with the weight to load on the bar
+    '''
+    __slots__ = ('exercise', 'set', 'reps', 'weight', 'weight_no_bar', 'weight_each_side',
+                 'plates_each_side')
+
+
+class PlanRow(Record):
+    '''
+    One set of one lift in a user's stored workout plan
+    '''
+    __slots__ = ('user_id', 'data_start_date', 'week', 'set_number', 'lift', 'weight', 'reps',
+                 'plates')
+
+
+class Delivery(Record):
+    '''
+    One emailed report and the outcome of sending it
+    '''
+    __slots__ = ('user_id', 'week_start', 'email', 'file', 'status', 'attempts', 'error',
+                 'sent_time')
+
+
+class AccessoryLift(Record):
+    '''
+    One accessory exercise
+    '''
+    __slots__ = ('me_name', 'ae_name', 'ae_weight', 'sets', 'reps')
+
+
+def as_records(cls, table):
+    '''
+    Converts a df to records of `cls` - lists of records are
+    returned as they are
+
+    Parameters
+    ----------
+    cls: type
+        Record subclass
+    table: obj, pandas df or list of Record
+
+    Returns
+    -------
+    list of Record
+    '''
+    if hasattr(table, 'itertuples'):
+        return cls.from_frame(table)
+    return table
+
+
+def table_rows(table, columns=None):
+    '''
+    Gets the columns and value tuples of a table
+
+    Parameters
+    ----------
+    table: obj, pandas df or list of Record or list of dict
+    columns: list of str, optional
+        columns to keep - defaults to every column of the df,
+        the fields of the records or the keys of the first dict
+
+    Returns
+    -------
+    columns: list of str
+    rows: list of tuple
+    '''
+    if hasattr(table, 'itertuples'):
+        if columns is not None and list(columns) != list(table.columns):
+            table = table[list(columns)]
+        return list(table.columns), list(table.itertuples(index=False, name=None))
+    if columns is None:
+        columns = []
+        if len(table) > 0:
+            first = table[0]
+            columns = first.__slots__ if isinstance(first, Record) else first.keys()
+    columns = list(columns)
+    if len(table) > 0 and isinstance(table[0], Record):
+        return columns, [tuple(getattr(row, col) for col in columns) for row in table]
+    return columns, [tuple(row[col] for col in columns) for row in table]
+
+
+def records_to_frame(records, cls=None):
+    '''
+    Converts records to a df - only needed at the notebook boundary
+
+    Parameters
+    ----------
+    records: list of Record
+    cls: type, optional
+        Record subclass, so an empty list still gets its columns
+
+    Returns
+    -------
+    obj, pandas df
+    '''
+    import pandas as pd
+
+    if cls is None:
+        cls = type(records[0])
+    return pd.DataFrame.from_records([record.values() for record in records],
+                                     columns=list(cls.__slots__))
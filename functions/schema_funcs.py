@@ -0,0 +1,269 @@
+'''functions for versioning and migrating the database schema'''
+
+from functions.dt_funcs import now
+from functions.log_funcs import get_logger
+
+logger = get_logger('schema')
+
+
+def key_conflicts(con, table, key, order=''):
+    '''
+    Finds the rows of a table that share a value of `key`
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    table: str
+    key: list of str
+        key columns
+    order: str, optional
+        ORDER BY clause the rows of each group are returned in
+
+    Returns
+    -------
+    conflicts: list of tuple
+        (key value, rows) for every value held by more than one row
+    '''
+    cols = ', '.join(key)
+    where = ' AND '.join(f'{col} IS ?' for col in key)
+    groups = con.execute(f'SELECT {cols} FROM {table} GROUP BY {cols} HAVING COUNT(*) > 1')
+    return [(group, con.execute(f'SELECT * FROM {table} WHERE {where} {order}', group).fetchall())
+            for group in groups.fetchall()]
+
+
+def rebuild_table(con, table, create, order_by=None, keys=None, on_conflict='merge'):
+    '''
+    Rebuilds a table with a new definition, keeping all
+    of its data
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    table: str
+    create: str
+        CREATE TABLE statement with a `{table}` placeholder
+        for the table name
+    order_by: str, optional
+        order rows are copied in - with a primary key, the
+        last copied row wins
+    keys: list of list of str, optional
+        primary key and unique columns of the new definition,
+        checked for rows that would conflict
+    on_conflict: str
+        `merge` to keep the last copied row of each conflict and log
+        the rows dropped, `abort` to raise instead
+
+    Raises
+    ------
+    ValueError
+        if `on_conflict` is abort and rows conflict on a key
+
+    Notes
+    -----
+    Columns are copied by name, so the new definition must
+    keep the column names of the old one
+    '''
+    assert on_conflict in ['merge', 'abort'], 'on_conflict must be "merge" or "abort"'
+    order = f'ORDER BY {order_by}' if order_by is not None else ''
+    for key in keys or []:
+        conflicts = key_conflicts(con, table, key, order)
+        if len(conflicts) > 0 and on_conflict == 'abort':
+            values = '; '.join(str(group) for group, _ in conflicts)
+            raise ValueError(f'{table} has rows sharing ({", ".join(key)}) - {values}. '
+                             'Resolve them before migrating')
+        for group, rows in conflicts:
+            logger.warning('%s rows share (%s) = %s - keeping %s, dropping %s', table,
+                           ', '.join(key), group, rows[-1], rows[:-1])
+    cols = [row[1] for row in con.execute(f'PRAGMA table_info({table})')]
+    con.execute(create.format(table=f'{table}_new'))
+    new_cols = [row[1] for row in con.execute(f'PRAGMA table_info({table}_new)')]
+    cols = ', '.join([col for col in cols if col in new_cols])
+    con.execute(f'INSERT OR REPLACE INTO {table}_new ({cols}) SELECT {cols} FROM {table} {order}')
+    con.execute(f'DROP TABLE {table}')
+    con.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+
+def migration_1(con):
+    '''
+    Adds primary keys, lookup indexes and declared column types
+    to the original tables
+    '''
+    rebuild_table(con, 'dim_user', '''
+    CREATE TABLE {table}(
+        user_id INTEGER PRIMARY KEY,
+        user_name TEXT NOT NULL UNIQUE,
+        email TEXT)''', order_by='user_id', keys=[['user_id'], ['user_name']],
+                  on_conflict='abort')
+    rebuild_table(con, 'dim_progression', '''
+    CREATE TABLE {table}(
+        user_id INTEGER PRIMARY KEY,
+        prog_dict JSON)''', order_by='rowid', keys=[['user_id']])
+    rebuild_table(con, 'one_rep_max', '''
+    CREATE TABLE {table}(
+        user_id INTEGER NOT NULL,
+        data_start_date TIMESTAMP NOT NULL,
+        data_end_date TIMESTAMP NOT NULL,
+        orm_dict JSON,
+        publish_time TIMESTAMP,
+        PRIMARY KEY (user_id, data_start_date))''', order_by='publish_time, rowid',
+                  keys=[['user_id', 'data_start_date']])
+    rebuild_table(con, 'accessory', '''
+    CREATE TABLE {table}(
+        user_id INTEGER NOT NULL,
+        me_name TEXT,
+        ae_name TEXT,
+        ae_weight REAL,
+        sets INTEGER,
+        reps INTEGER,
+        publish_time TIMESTAMP NOT NULL)''', order_by='rowid')
+    rebuild_table(con, 'pause_workout', '''
+    CREATE TABLE {table}(
+        user_id INTEGER PRIMARY KEY,
+        pause_date TIMESTAMP DEFAULT '2999-12-31 23:59:59',
+        pause_flag TEXT DEFAULT 'False')''', order_by='rowid', keys=[['user_id']])
+    # `DEFAULT False` stored 0, which never matches the "False" filters - those
+    # users have never been sent a report, so they are left inactive
+    unset = [row[0] for row in con.execute('''
+    SELECT user_id FROM pause_workout
+    WHERE pause_flag IS NULL OR pause_flag NOT IN ('True', 'False')''')]
+    if len(unset) > 0:
+        logger.warning('pause_flag is neither True nor False for user_ids %s - they stay '
+                       'inactive until it is set to False', unset)
+    con.execute('''
+    CREATE INDEX idx_one_rep_max_user_end
+    ON one_rep_max(user_id, data_end_date, data_start_date)''')
+    con.execute('''
+    CREATE INDEX idx_accessory_user_publish
+    ON accessory(user_id, publish_time)''')
+
+
+def migration_2(con):
+    '''
+    Adds report_fingerprint, which stores a hash of the inputs
+    of each user's last built report
+    '''
+    con.execute('''
+    CREATE TABLE report_fingerprint(
+        user_id INTEGER NOT NULL,
+        file TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        build_time TIMESTAMP,
+        PRIMARY KEY (user_id, file))''')
+
+
+def migration_3(con):
+    '''
+    Adds orm_chart, which caches each user's rendered
+    orm progression chart
+    '''
+    con.execute('''
+    CREATE TABLE orm_chart(
+        user_id INTEGER PRIMARY KEY,
+        chart_key TEXT NOT NULL,
+        svg TEXT NOT NULL)''')
+
+
+def migration_4(con):
+    '''
+    Adds workout_plan, the materialized sets of every one_rep_max month
+
+    Notes
+    -----
+    * WITHOUT ROWID stores the rows in primary key order, so the key
+    is a covering index for the (user_id, data_start_date, week)
+    lookups made by reports
+    * The table starts empty - plans are derived from the current
+    workout code, so months are filled in by `create_db` instead
+    '''
+    con.execute('''
+    CREATE TABLE workout_plan(
+        user_id INTEGER NOT NULL,
+        data_start_date TIMESTAMP NOT NULL,
+        week INTEGER NOT NULL,
+        set_number INTEGER NOT NULL,
+        lift TEXT NOT NULL,
+        weight INTEGER NOT NULL,
+        reps INTEGER NOT NULL,
+        plates TEXT,
+        PRIMARY KEY (user_id, data_start_date, week, set_number, lift)) WITHOUT ROWID''')
+
+
+def migration_5(con):
+    '''
+    Adds email_delivery, which records the outcome of
+    emailing each user's report for each week
+    '''
+    con.execute('''
+    CREATE TABLE email_delivery(
+        user_id INTEGER NOT NULL,
+        week_start TIMESTAMP NOT NULL,
+        email TEXT,
+        file TEXT,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        error TEXT,
+        sent_time TIMESTAMP,
+        PRIMARY KEY (user_id, week_start))''')
+
+
+migrations = [(1, 'primary keys, indexes and column types', migration_1),
+              (2, 'report fingerprints', migration_2),
+              (3, 'orm chart cache', migration_3),
+              (4, 'materialized workout plan', migration_4),
+              (5, 'email delivery status', migration_5)]
+
+
+def get_version(con):
+    '''
+    Gets the current schema version of the database
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+
+    Returns
+    -------
+    version: int
+        0 if no migration has been applied
+    '''
+    con.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version(
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_time TIMESTAMP)''')
+    version = con.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    return 0 if version is None else version
+
+
+def migrate(con):
+    '''
+    Applies every migration newer than the current schema version,
+    each in its own transaction
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+        tables from `create_db` must already exist
+
+    Returns
+    -------
+    version: int
+        schema version after migrating
+    '''
+    version = get_version(con)
+    con.commit()
+    for number, description, migration in migrations:
+        if number <= version:
+            continue
+        try:
+            con.execute('BEGIN')
+            migration(con)
+            con.execute('INSERT INTO schema_version VALUES (?, ?, ?)',
+                        [number, description, now(date=False)])
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+        logger.info('schema migrated to version %s - %s', number, description)
+        version = number
+    return version
@@ -0,0 +1,378 @@
+'''functions for serving the current workout over http'''
+
+import argparse
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from functions.db_funcs import ConnectionPool, DBHelper, apply_writes, create_db
+from functions.html_funcs import template_version, write_report
+from functions.log_funcs import get_logger
+from functions.plan_funcs import plan_reference_sets, plan_workout_sets
+from functions.workout_funcs import lifts
+
+logger = get_logger('serve')
+
+content_types = {'html': 'text/html; charset=utf-8',
+                 'json': 'application/json'}
+
+
+class LRUCache(object):
+    '''
+    Thread safe least recently used cache
+
+    Parameters
+    ----------
+    maxsize: int
+        number of entries kept
+    '''
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        Returns
+        -------
+        obj, varying
+            the cached value, None if `key` is not cached
+        '''
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        '''
+        Caches `value`, dropping the least recently used
+        entry if the cache is full
+        '''
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class WorkoutService(object):
+    '''
+    Builds the current week's workout of a user, cached on
+    everything the workout depends on
+
+    Parameters
+    ----------
+    db: str
+        sqlite database name
+    readers: int
+        number of read connections - see `ConnectionPool`
+    cache_size: int
+        number of workouts kept in memory
+
+    Notes
+    -----
+    * Requests are served on the read connections. The only writes -
+    progressing one_rep_max into a new month and filling in a missing
+    plan - go through the pool's writer
+    * A cached workout is keyed on (user_id, month, week, accessory
+    publish_time), where the month is the one_rep_max row's
+    data_start_date, publish_time and a hash of its orm_dict, so
+    editing the current month's weights is picked up too
+    '''
+
+    def __init__(self, db='workout.db', readers=4, cache_size=256):
+        self.pool = ConnectionPool(db, readers=readers)
+        with self.pool.writer() as con:
+            create_db(con)
+        self.cache = LRUCache(cache_size)
+
+    def user_id(self, name):
+        '''
+        Looks up the user_id of a user_name
+
+        Returns
+        -------
+        int
+        None
+            If the user does not exist
+        '''
+        with self.pool.reader() as con:
+            row = con.execute('SELECT user_id FROM dim_user WHERE user_name = ?',
+                              [name]).fetchone()
+        return None if row is None else row[0]
+
+    def cache_key(self, helper):
+        '''
+        Gets the cache key of a user's current workout
+
+        Parameters
+        ----------
+        helper: obj, DBHelper
+
+        Returns
+        -------
+        key: tuple
+        None
+            If the user has no one_rep_max for this month
+        '''
+        orm = helper.get_orm_entry()
+        if orm is None:
+            return None
+        weights = hashlib.sha1(orm.orm_dict.encode()).hexdigest()
+        return (helper.user_id, str(orm.data_start_date), str(orm.publish_time), weights,
+                int(helper.get_current_week()), str(helper.get_accessory_publish_time()))
+
+    def build(self, helper):
+        '''
+        Reads everything shown in the workout
+
+        Parameters
+        ----------
+        helper: obj, DBHelper
+
+        Returns
+        -------
+        view: obj, dict
+            the workout, with a `bodies` dict the rendered
+            formats are kept in
+        '''
+        week, start, end = helper.get_week_vals()
+        plan = helper.get_plan(week)
+        if len(helper.pending_writes) > 0:
+            with self.pool.writer() as con:
+                apply_writes(con, helper.pending_writes)
+        return {'user': helper.user, 'week': int(week), 'start': start, 'end': end,
+                'one_rep_max': helper.get_orm_entry().weights,
+                'workout': plan_workout_sets(plan),
+                'reference': plan_reference_sets(plan),
+                'accessory': helper.get_accessory_lifts(), 'bodies': {}}
+
+    def lookup(self, name, user_id):
+        '''
+        Gets the current workout of a user from the cache,
+        building it on a miss - see `workout`
+        '''
+        with self.pool.reader() as con:
+            helper = DBHelper(con, name, defer_writes=True, user_id=user_id)
+            key = self.cache_key(helper)
+            if key is None:
+                return None, None
+            view = self.cache.get(key)
+            if view is None:
+                view = self.build(helper)
+                self.cache.put(key, view)
+        return key, view
+
+    def workout(self, name):
+        '''
+        Gets the current workout of a user from the cache,
+        building it on a miss
+
+        Parameters
+        ----------
+        name: str
+            user_name in dim_user
+
+        Returns
+        -------
+        key: tuple
+            see `cache_key`
+        view: obj, dict
+            see `build` - None if the user does not exist or
+            has no one_rep_max populated
+        '''
+        user_id = self.user_id(name)
+        if user_id is None:
+            return None, None
+        key, view = self.lookup(name, user_id)
+        if key is None:
+            # the month has rolled over since the last report run
+            with self.pool.writer() as con:
+                DBHelper(con, name, user_id=user_id).progress_one_rep_max()
+            key, view = self.lookup(name, user_id)
+        return key, view
+
+    def close(self):
+        '''
+        Closes the connection pool
+        '''
+        self.pool.close()
+
+
+def etag(key, fmt):
+    '''
+    Gets the entity tag of a workout - it only changes when
+    the cache key or the template does
+
+    Parameters
+    ----------
+    key: tuple
+        see `WorkoutService.cache_key`
+    fmt: str
+        `html` or `json`
+
+    Returns
+    -------
+    str
+    '''
+    digest = hashlib.sha1(repr((key, template_version)).encode()).hexdigest()[:20]
+    return f'"{digest}-{fmt}"'
+
+
+def etag_matches(header, tag):
+    '''
+    Checks an If-None-Match header against an entity tag
+
+    Parameters
+    ----------
+    header: str
+        comma separated entity tags, or `*`
+    tag: str
+
+    Returns
+    -------
+    bool
+    '''
+    if header is None:
+        return False
+    tags = [value.strip() for value in header.split(',')]
+    # weak comparison, as If-None-Match calls for
+    return '*' in tags or tag in [value[2:] if value.startswith('W/') else value
+                                  for value in tags]
+
+
+def render(view, fmt):
+    '''
+    Renders a workout
+
+    Parameters
+    ----------
+    view: obj, dict
+        from `WorkoutService.build`
+    fmt: str
+        `html` or `json`
+
+    Returns
+    -------
+    bytes
+    '''
+    if fmt == 'json':
+        body = {'user': view['user'], 'week': view['week'],
+                'start': str(view['start']), 'end': str(view['end']),
+                'one_rep_max': {lift: view['one_rep_max'][lift] for lift in lifts},
+                'workout': [row.to_dict() for row in view['workout']],
+                'reference': [row.to_dict() for row in view['reference']],
+                'accessory': [row.to_dict() for row in view['accessory']]}
+        return json.dumps(body).encode()
+    out = io.StringIO()
+    write_report(out, [view['one_rep_max']], view['workout'], view['accessory'],
+                 view['week'], view['start'], view['end'], reference=view['reference'])
+    return out.getvalue().encode()
+
+
+class WorkoutHandler(BaseHTTPRequestHandler):
+    '''
+    Serves `GET /users/{name}/week/current` as html, or as json
+    with `?format=json` or an `Accept: application/json` header
+    '''
+    service = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        if len(parts) != 4 or parts[0] != 'users' or parts[2:] != ['week', 'current']:
+            return self.send_body(404, b'not found', 'text/plain')
+        fmt = parse_qs(url.query).get('format', [None])[0]
+        if fmt is None:
+            fmt = 'json' if 'application/json' in self.headers.get('Accept', '') else 'html'
+        if fmt not in content_types:
+            return self.send_body(400, f'unknown format {fmt}'.encode(), 'text/plain')
+        try:
+            key, view = self.service.workout(parts[1])
+        except Exception:
+            logger.exception('workout failed for %s', parts[1])
+            return self.send_body(500, b'workout failed', 'text/plain')
+        if view is None:
+            return self.send_body(404, f'no workout for {parts[1]}'.encode(), 'text/plain')
+        tag = etag(key, fmt)
+        if etag_matches(self.headers.get('If-None-Match'), tag):
+            return self.send_body(304, b'', headers={'ETag': tag})
+        bodies = view['bodies']
+        if fmt not in bodies:
+            bodies[fmt] = render(view, fmt)
+        self.send_body(200, bodies[fmt], content_types[fmt], {'ETag': tag})
+
+    do_HEAD = do_GET
+
+    def send_body(self, status, body, content_type=None, headers=None):
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        # clients may reuse a cached copy, but must revalidate it first
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+def make_server(service, host='127.0.0.1', port=8000):
+    '''
+    Creates a threaded http server for a workout service
+
+    Parameters
+    ----------
+    service: obj, WorkoutService
+    host: str
+        use 0.0.0.0 to serve other devices on the network
+    port: int
+
+    Returns
+    -------
+    obj, http.server.ThreadingHTTPServer
+        call `serve_forever` to start it
+    '''
+    handler = type('BoundWorkoutHandler', (WorkoutHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves the current workout of every user')
+    parser.add_argument('--db', default='workout.db')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='use 0.0.0.0 to serve other devices on the network')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--cache-size', type=int, default=256)
+    args = parser.parse_args()
+    service = WorkoutService(args.db, readers=args.readers, cache_size=args.cache_size)
+    server = make_server(service, args.host, args.port)
+    logger.info('serving workouts on http://%s:%s/users/{name}/week/current',
+                args.host, server.server_port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
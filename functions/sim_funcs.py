@@ -0,0 +1,263 @@
+'''functions for projecting one rep max progression many months ahead'''
+
+import numpy as np
+import pandas as pd
+
+from functions.db_funcs import read_sql
+from functions.dt_funcs import now
+from functions.json_funcs import decode_column
+from functions.metrics_funcs import timed
+from functions.workout_funcs import lifts, orm_array, workout_weights
+
+# one_rep_max months are four weeks long
+month_days = 28
+
+
+def months_in(years):
+    '''
+    Gets the number of four week months in `years`
+
+    Parameters
+    ----------
+    years: float
+
+    Returns
+    -------
+    int
+    '''
+    return int(round(years * 365.25 / month_days))
+
+
+def project_orms(orms, progs, months):
+    '''
+    Projects one rep maxes forward by adding the progression
+    once per month, as `catch_up_orm` does
+
+    Parameters
+    ----------
+    orms: obj, numpy array
+        (users x lifts) array of starting one rep maxes, from `orm_array`
+    progs: obj, numpy array
+        monthly increments, broadcast against `orms` - (users x lifts)
+        for each user's own progression, (schemes x 1 x lifts) to try
+        every scheme on every user
+    months: int
+        number of months, the starting month included
+
+    Returns
+    -------
+    obj, numpy array
+        (... x users x months x lifts) array - month 0 is the starting month
+    '''
+    orms = np.asarray(orms, dtype=float)
+    progs = np.asarray(progs, dtype=float)
+    steps = np.arange(months, dtype=float)[:, None]
+    return orms[..., None, :] + progs[..., None, :] * steps
+
+
+def month_starts(start_dates, end_dates, months):
+    '''
+    Gets the start date of every projected month
+
+    Parameters
+    ----------
+    start_dates: array-like of timestamps
+        start of each user's starting month
+    end_dates: array-like of timestamps
+        end of each user's starting month
+    months: int
+
+    Returns
+    -------
+    obj, numpy array
+        (users x months) array of datetime64 - month 1 starts on the
+        sunday after the starting month ends, as in `new_month`
+    '''
+    start_dates = pd.to_datetime(pd.Series(start_dates)).values.astype('datetime64[D]')
+    first = pd.to_datetime(pd.Series(end_dates)) + pd.Timedelta(days=1)
+    first = (first + pd.to_timedelta(6 - first.dt.dayofweek, unit='D')).values.astype('datetime64[D]')
+    offsets = np.arange(-1, months - 1) * np.timedelta64(month_days, 'D')
+    starts = first[:, None] + offsets
+    starts[:, 0] = start_dates
+    return starts
+
+
+class Simulation(object):
+    '''
+    One rep maxes and set weights of many users, projected
+    month by month under one or more progression schemes
+
+    Parameters
+    ----------
+    user_ids: list of int
+    start_dates: obj, numpy array
+        (users x months) month start dates, from `month_starts`
+    orms: obj, numpy array
+        (schemes x users x months x lifts), from `project_orms`
+    schemes: list of str
+        scheme names, in the order of the first axis of `orms`
+
+    Notes
+    -----
+    Set weights are only worked out when asked for, as they are
+    twelve times the size of the one rep maxes
+    '''
+
+    def __init__(self, user_ids, start_dates, orms, schemes):
+        self.user_ids = list(user_ids)
+        self.start_dates = start_dates
+        self.orms = orms
+        self.schemes = list(schemes)
+
+    def set_weights(self, months=None):
+        '''
+        Gets the weight of every set of every week
+
+        Parameters
+        ----------
+        months: list of int, optional
+            month indexes to keep - defaults to all months
+
+        Returns
+        -------
+        obj, numpy array
+            (schemes x users x months x weeks x sets x lifts) array
+            rounded to the nearest 5, see `workout_weights`
+        '''
+        orms = self.orms if months is None else self.orms[:, :, months]
+        return workout_weights(orms)
+
+    def frame(self):
+        '''
+        Flattens the projected one rep maxes into a long df
+
+        Returns
+        -------
+        obj, pandas df
+            one row per scheme, user and month, with a column per lift
+        '''
+        schemes, users, months, _ = self.orms.shape
+        df = pd.DataFrame(self.orms.reshape(-1, len(lifts)), columns=lifts)
+        df.insert(0, 'scheme', np.repeat(self.schemes, users * months))
+        df.insert(1, 'user_id', np.tile(np.repeat(self.user_ids, months), schemes))
+        df.insert(2, 'month', np.tile(np.arange(months), schemes * users))
+        df.insert(3, 'data_start_date', np.tile(self.start_dates.reshape(-1), schemes))
+        return df
+
+    def summary(self):
+        '''
+        Compares the schemes by the one rep maxes they end on
+
+        Returns
+        -------
+        obj, pandas df
+            one row per scheme and user, with the final one rep max of
+            each lift and the `total` of them
+        '''
+        final = self.orms[:, :, -1]
+        schemes, users, _ = final.shape
+        df = pd.DataFrame(final.reshape(-1, len(lifts)), columns=lifts)
+        df.insert(0, 'scheme', np.repeat(self.schemes, users))
+        df.insert(1, 'user_id', np.tile(self.user_ids, schemes))
+        df['total'] = final.sum(axis=-1).reshape(-1)
+        return df
+
+
+@timed()
+def simulate(user_ids, orm_dicts, prog_dicts=None, schemes=None, start_dates=None,
+             end_dates=None, years=1, months=None):
+    '''
+    Projects many users' one rep maxes `years` ahead in one
+    broadcast operation
+
+    Parameters
+    ----------
+    user_ids: list of int
+    orm_dicts: list of dict
+        starting one rep max of each user
+    prog_dicts: list of dict, optional
+        monthly progression of each user, as stored in dim_progression
+    schemes: obj, dict, optional
+        {scheme name: progression dict} - every scheme is applied
+        to every user, instead of their own progression
+    start_dates: array-like of timestamps, optional
+        start of each user's starting month - defaults to the
+        sunday on or before today
+    end_dates: array-like of timestamps, optional
+        end of each user's starting month - defaults to
+        four weeks after the start
+    years: float
+        how far ahead to project
+    months: int, optional
+        number of months to project, the starting month
+        included - overrides `years`
+
+    Returns
+    -------
+    obj, Simulation
+        the users' own progression is the scheme `current`
+    '''
+    assert prog_dicts is not None or schemes is not None, 'pass prog_dicts or schemes'
+    if months is None:
+        months = months_in(years) + 1
+    if start_dates is None:
+        today = pd.Timestamp(now())
+        start_dates = [today - pd.Timedelta(days=(today.dayofweek + 1) % 7)] * len(user_ids)
+    if end_dates is None:
+        end_dates = pd.to_datetime(pd.Series(start_dates)) + pd.Timedelta(days=month_days - 1)
+    orms = orm_array(orm_dicts)
+    if schemes is None:
+        names = ['current']
+        progs = orm_array(prog_dicts)[None]
+    else:
+        names = list(schemes)
+        progs = orm_array([schemes[name] for name in names])[:, None]
+    return Simulation(user_ids, month_starts(start_dates, end_dates, months),
+                      project_orms(orms, progs, months), names)
+
+
+def simulate_users(con, schemes=None, years=1, months=None, user_ids=None):
+    '''
+    Projects every active user from their latest one_rep_max month
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+    schemes: obj, dict, optional
+        see `simulate` - defaults to each user's dim_progression
+    years: float
+    months: int, optional
+    user_ids: list of int, optional
+        only project these users
+
+    Returns
+    -------
+    obj, Simulation
+
+    Notes
+    -----
+    Users without a progression are left out unless `schemes` is set
+    '''
+    s = '''
+    SELECT o.user_id, o.data_start_date, o.data_end_date, o.orm_dict, p.prog_dict
+    FROM one_rep_max o
+    INNER JOIN
+    (SELECT user_id, MAX(data_end_date) as data_end_date
+    FROM one_rep_max
+    WHERE user_id IN (SELECT user_id FROM pause_workout WHERE pause_flag = "False")
+    GROUP BY user_id) latest
+    USING (user_id, data_end_date)
+    LEFT JOIN dim_progression p
+    USING (user_id)
+    ORDER BY o.user_id
+    '''
+    latest = read_sql(s, con).drop_duplicates('user_id')
+    if user_ids is not None:
+        latest = latest[latest['user_id'].isin(user_ids)]
+    prog_dicts = None
+    if schemes is None:
+        latest = latest[latest['prog_dict'].notnull()]
+        prog_dicts = decode_column(latest['prog_dict']).tolist()
+    return simulate(latest['user_id'].tolist(), decode_column(latest['orm_dict']).tolist(),
+                    prog_dicts, schemes, latest['data_start_date'], latest['data_end_date'],
+                    years, months)
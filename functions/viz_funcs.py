@@ -1,10 +1,9 @@
 '''functions for visualizing weight progression'''
 
-import ast
-
+import numpy as np
 import pandas as pd
-import plotly.graph_objs as go
-from plotly.offline import iplot
+
+from functions.json_funcs import explode_column
 
 
 def format_orm(orm):
@@ -12,18 +11,72 @@ def format_orm(orm):
     formats orm dictionary field into something more appropriate
     for visualization
     '''
-    orm['orm_dict'] = orm['orm_dict'].apply(lambda x: ast.literal_eval(x))
-    weights = pd.DataFrame.from_dict(orm['orm_dict'].to_dict(), orient='index')
+    weights = explode_column(orm[['orm_dict']], 'orm_dict')
     formatted = orm[['data_start_date', 'data_end_date']].join(weights)
     return formatted
 
 
+lift_colors = [('squat', '#4c72b0'), ('bench', '#55a868'),
+               ('deadlift', '#c44e52'), ('ohp', '#8172b2')]
+
+
+def orm_svg(df, width=700, height=300, margin=40):
+    '''
+    Renders the progression of each orm exercise as an inline
+    svg line chart - no plotting library needed
+
+    Parameters
+    ----------
+    df: obj, pandas df
+        `data_start_date` and one column per lift, e.g. the
+        output of `functions.dt_funcs.orm_timeline`
+    width: int
+    height: int
+    margin: int
+        space left around the plot for the axis labels
+
+    Returns
+    -------
+    svg: str
+    '''
+    df = df.sort_values('data_start_date').reset_index(drop=True)
+    lifts = [(lift, color) for lift, color in lift_colors if lift in df.columns]
+    weights = df[[lift for lift, _ in lifts]].to_numpy(dtype=float)
+    low, high = np.nanmin(weights), np.nanmax(weights)
+    if high == low:
+        high = low + 1
+    steps = max(df.shape[0] - 1, 1)
+    xs = margin + np.arange(df.shape[0]) * (width - 2 * margin) / steps
+    ys = height - margin - (weights - low) * (height - 2 * margin) / (high - low)
+    start = pd.Timestamp(df['data_start_date'].iloc[0]).date()
+    end = pd.Timestamp(df['data_start_date'].iloc[-1]).date()
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="11">',
+             f'<polyline fill="none" stroke="#999" points="{margin},{margin} {margin},'
+             f'{height - margin} {width - margin},{height - margin}"/>',
+             f'<text x="{margin - 4}" y="{margin + 4}" text-anchor="end">{high:g}</text>',
+             f'<text x="{margin - 4}" y="{height - margin}" text-anchor="end">{low:g}</text>',
+             f'<text x="{margin}" y="{height - margin + 14}">{start}</text>',
+             f'<text x="{width - margin}" y="{height - margin + 14}" text-anchor="end">{end}</text>']
+    for i, (lift, color) in enumerate(lifts):
+        keep = ~np.isnan(ys[:, i])
+        points = ' '.join(f'{x:.1f},{y:.1f}' for x, y in zip(xs[keep], ys[keep, i]))
+        parts.append(f'<polyline fill="none" stroke="{color}" stroke-width="2" points="{points}"/>')
+        parts.append(f'<text x="{margin + 10 + i * 80}" y="{margin - 10}" fill="{color}">{lift}</text>')
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
 def plot_orm(df):
     '''
     Plots progression for each orm exercise
     '''
-    data_params = [('squat', '#4c72b0'), ('bench', '#55a868'),
-                   ('deadlift', '#c44e52'), ('ohp', '#8172b2')]
+    # plotly is slow to import and only needed for notebook plots
+    import plotly.graph_objs as go
+    from plotly.offline import iplot
+
+    data_params = lift_colors
 
     plot_data = [go.Scatter(
         x=df['data_start_date'],
@@ -1,82 +1,104 @@
 ''' dataframe and dictionary manipulation functions to get workout weights'''
-import pandas as pd
+import numpy as np
+
+from functions.plate_funcs import format_loading, get_calculator
+from functions.record_funcs import (ReferenceSet, WorkoutSet, as_records,
+                                    records_to_frame)
 
 week_mapping = {1:{'mod':[.65, .75, .85], 'reps':[5,5,5]},
                 2:{'mod':[.7, .8, .9], 'reps':[3,3,3]},
                 3:{'mod':[.75, .85, .95], 'reps':[5,3,1]},
                 4:{'mod':[.4, .5, .6], 'reps':[10,10,10]}}
 
-def explode_df(df):
+lifts = ['deadlift', 'squat', 'bench', 'ohp']
+
+# `week_mapping` as (weeks x sets) matrices, precomputed once
+week_numbers = sorted(week_mapping)
+week_mods = np.array([week_mapping[week]['mod'] for week in week_numbers])
+week_reps = np.array([week_mapping[week]['reps'] for week in week_numbers], dtype='int64')
+
+def orm_array(orm_dicts):
     '''
-    Explodes a pandas dataframe with `list` columns
+    Stacks orm dicts into an array
 
     Parameters
     ----------
-    df: obj, pandas df
+    orm_dicts: list of dict
+        dicts containing orm weights
 
     Returns
     -------
-    obj, pandas df
-        exploded df
+    obj, numpy array
+        (users x lifts) array of orm weights, with
+        lifts ordered as in `lifts`
     '''
-    explode = pd.DataFrame()
-    for i in df.index:
-        entry = df.loc[i]
-        to_ex = {i:entry[i] for i in entry.keys() if type(entry[i])==list}
-        no_ex = [i for i in entry.keys() if i not in to_ex.keys()]
-        explosion = pd.DataFrame(to_ex)
-        for i in no_ex:
-            explosion[i] = entry[i]
-        explode = pd.concat([explode, explosion])
-
-    return explode.reset_index(drop=True)
-
-def get_mapping_df(orm_dict):
+    return np.array([[orm_dict[lift] for lift in lifts] for orm_dict in orm_dicts],
+                    dtype=float).reshape(-1, len(lifts))
+
+def workout_weights(orms):
     '''
-    Creates a staging df containing orm_weights
-    along with raw `week_mapping` values  
+    Generates the set weights of every week for many
+    users in one broadcast operation
 
     Parameters
     ----------
-    orm_dict: dict
-        dict containing orm weights
-    
+    orms: obj, numpy array
+        (users x lifts) array of orm weights, from `orm_array`
+
     Returns
     -------
-    mapping_df: obj, pandas df
+    obj, numpy array
+        (users x weeks x sets x lifts) array of weights
+        rounded to the nearest 5
     '''
-    week_df = pd.DataFrame.from_dict(week_mapping, orient='index')
-    week_df['week'] = week_df.index
-    orm_df = pd.concat([pd.DataFrame(orm_dict, index=[i]) for i in week_df.index])
-    mapping_df = week_df.join(orm_df)
-    
-    return mapping_df
+    orms = np.asarray(orms, dtype=float)
+    weights = orms[..., None, None, :] * week_mods[..., None] / 5
+    return (np.round(weights) * 5).astype('int64')
 
-def map_weights(mapping_df, weeks):
+def workout_sets(weights, weeks):
     '''
-    Explodes and generates actual weights given the staging df
-    outputted from `get_mapping_df`
+    Converts the weights of one user into workout sets
 
     Parameters
     ----------
-    mapping_df: obj, pandas df
-        output from get_mapping_df()
+    weights: obj, numpy array
+        (weeks x sets x lifts) array, from `workout_weights`
     weeks: list
         weeks to return workout for
-    
+
     Returns
     -------
-    workout: obj, pandas df
+    list of WorkoutSet
+        sets are numbered across all returned weeks
     '''
-    full_df = explode_df(mapping_df)
-    workout = full_df[full_df.week.isin(weeks)].reset_index(drop=True)
-    for col in ['bench', 'deadlift', 'ohp', 'squat']:
-        workout[col] = round(workout[col] * workout['mod']/5)*5
-        workout[col] = workout[col].astype(int)
-    workout['set'] = workout.index + 1
-    workout = workout[['week', 'set', 'reps', 'deadlift', 'squat', 'bench', 'ohp']]
-    
-    return workout
+    weights = weights.tolist()
+    sets = []
+    for ix, week in enumerate(week_numbers):
+        if week not in weeks:
+            continue
+        for lift_weights, reps in zip(weights[ix], week_reps[ix].tolist()):
+            sets.append(WorkoutSet(week, len(sets) + 1, reps, *lift_weights))
+    return sets
+
+def get_workout_sets(orm_dict, weeks):
+    '''
+    Generates the sets of the main workout
+
+    Parameters
+    ----------
+    orm_dict: dict
+        dict containing orm weights
+    weeks: list
+        weeks to return workout for
+
+    Returns
+    -------
+    list of WorkoutSet
+    '''
+    if type(weeks) != list:
+        weeks = [weeks]
+    weights = workout_weights(orm_array([orm_dict]))[0]
+    return workout_sets(weights, weeks)
 
 def get_workout(orm_dict, weeks):
     '''
@@ -94,14 +116,39 @@ def get_workout(orm_dict, weeks):
     -------
     workout: obj, pandas df
     '''
-    if type(weeks) != list:
-        weeks = [weeks]
-    mapping_df = get_mapping_df(orm_dict)
-    workout = map_weights(mapping_df, weeks)
-    
-    return workout
+    return records_to_frame(get_workout_sets(orm_dict, weeks), WorkoutSet)
 
-def reference_gen(workout_df):
+def reference_sets(workout, calculator=None):
+    '''
+    Generates the weight reference of every set of every lift
+
+    Parameters
+    ----------
+    workout: list of WorkoutSet or obj, pandas df
+    calculator: obj, PlateCalculator, optional
+        plate inventory and bar weight - defaults to
+        `functions.plate_funcs.default_plates` on a 45lb bar
+
+    Returns
+    ------
+    list of ReferenceSet
+        grouped by lift, with the plates to load on each side of the bar
+        picked to keep plate changes between sets to a minimum
+    '''
+    if calculator is None:
+        calculator = get_calculator()
+    workout = as_records(WorkoutSet, workout)
+    ref = []
+    for exercise in lifts:
+        weights = [getattr(row, exercise) for row in workout]
+        plates = calculator.session_loadings(weights)
+        for row, weight, stack in zip(workout, weights, plates):
+            weight_no_bar = weight - calculator.bar
+            ref.append(ReferenceSet(exercise, row.set, row.reps, weight, weight_no_bar,
+                                    -(weight_no_bar // -2), format_loading(stack)))
+    return ref
+
+def reference_gen(workout_df, calculator=None):
     '''
     Generates a workout weight reference chart from
     the full workout df
@@ -109,15 +156,13 @@ def reference_gen(workout_df):
     Parameters
     ----------
     workout_df: obj, pandas df
+    calculator: obj, PlateCalculator, optional
+        see `reference_sets`
 
     Returns
     ------
     obj, pandas df
-        reference df
+        reference df, with the plates to load on each side of the bar
+        picked to keep plate changes between sets to a minimum
     '''
-    ref_df = pd.melt(workout_df, id_vars=['week', 'set', 'reps'], var_name='exercise', value_name='weight')
-    ref_df['weight_no_bar'] = ref_df['weight'] - 45
-    ref_df['weight_each_side'] = -(ref_df['weight_no_bar'] // -2)
-    cols = ['exercise', 'set', 'reps', 'weight', 'weight_no_bar', 'weight_each_side']
-    
-    return ref_df[cols]
+    return records_to_frame(reference_sets(workout_df, calculator), ReferenceSet)
@@ -0,0 +1,72 @@
+'''fixtures shared by the tests'''
+
+import pandas as pd
+import pytest
+
+from functions.db_funcs import DBHelper, create_db, get_db_con, table_overwrite
+from functions.dt_funcs import now
+from functions.json_funcs import encode
+from functions.record_funcs import OrmEntry
+
+weights = {'squat': 500, 'bench': 300, 'deadlift': 600, 'ohp': 200}
+progression = {'squat': 10, 'bench': 5, 'deadlift': 10, 'ohp': 5}
+
+
+def this_sunday():
+    '''
+    Gets the sunday on or before today
+    '''
+    today = pd.Timestamp(now())
+    return today - pd.Timedelta(days=(today.dayofweek + 1) % 7)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    '''
+    Path to a new database - the tests run in `tmp_path`, so
+    reports and logs are written there too
+    '''
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / 'workout.db')
+
+
+@pytest.fixture
+def con(db):
+    con = get_db_con(db)
+    create_db(con)
+    yield con
+    con.close()
+
+
+@pytest.fixture
+def seed(con):
+    '''
+    Adds a user with a progression and one four week month of
+    one_rep_max starting `months_ago` months before this one
+
+    Returns
+    -------
+    function
+        takes the user name, `months_ago` and the weights,
+        and returns the user's DBHelper
+    '''
+    def seed(user, months_ago=0, orm_dict=weights):
+        helper = DBHelper(con, user, f'{user}@example.com')
+        helper.set_dim_prog(progression)
+        start = this_sunday() - pd.Timedelta(days=28 * months_ago)
+        entry = OrmEntry(helper.user_id, start, start + pd.Timedelta(days=27),
+                         encode(orm_dict), now(date=False))
+        table_overwrite('one_rep_max', [entry], ['user_id', 'data_start_date'], con)
+        return helper
+    return seed
+
+
+@pytest.fixture
+def workout_maker(db):
+    '''
+    The workout_maker module - it opens workout.db in the working
+    directory on import, so it is only imported once the test has
+    moved to `tmp_path`
+    '''
+    import workout_maker
+    return workout_maker
@@ -0,0 +1,49 @@
+'''tests for the date functions'''
+
+import pandas as pd
+
+from functions.dt_funcs import get_month, orm_timeline, resolve_dates
+
+start = pd.Timestamp('2026-01-04')
+
+
+def month(user_id, start, days=28):
+    return {'user_id': user_id, 'data_start_date': start,
+            'data_end_date': start + pd.Timedelta(days=days - 1), 'orm_dict': f'{user_id}-{start:%m%d}'}
+
+
+one_rep_max = pd.DataFrame([month(1, start - pd.Timedelta(days=7), days=7), month(1, start),
+                            month(1, start + pd.Timedelta(days=28)), month(2, start)])
+
+
+def test_resolve_dates_matches_each_user_and_date():
+    dts = [start + pd.Timedelta(days=30), start - pd.Timedelta(days=2), start + pd.Timedelta(days=15),
+           start + pd.Timedelta(days=60), start + pd.Timedelta(days=15), start - pd.Timedelta(days=30)]
+    resolved = resolve_dates(one_rep_max, [1, 1, 1, 1, 2, 2], dts)
+    assert resolved['dt'].tolist() == dts
+    assert resolved['orm_dict'].tolist()[:3] == ['1-0201', '1-1228', '1-0104']
+    assert resolved['week'].tolist()[:3] == [1, 1, 3]
+    assert resolved['orm_dict'].isnull().tolist() == [False, False, False, True, False, True]
+    assert resolved['week'][4] == 3
+    assert pd.isnull(resolved['week'][3])
+
+
+def test_get_month_only_matches_covering_month():
+    user = one_rep_max[one_rep_max['user_id'] == 1].reset_index(drop=True)
+    match = get_month(user, start + pd.Timedelta(days=27))
+    assert match['orm_dict'].tolist() == ['1-0104']
+    assert get_month(user, start + pd.Timedelta(days=56)) is None
+
+
+def test_orm_timeline_starts_rows_on_each_entry():
+    days = [-7, 0, 28, 112, 0]
+    orm = pd.DataFrame({'user_id': [1, 1, 1, 1, 2],
+                        'data_start_date': [start + pd.Timedelta(days=d) for d in days],
+                        'squat': [100, 100, 110, 130, 200]})
+    timeline = orm_timeline(orm)
+    alice = timeline[timeline['user_id'] == 1]
+    # the buffer week does not shift the months, the gap is carried
+    # forward and the last entry is kept
+    assert [(d - start).days for d in alice['data_start_date']] == [-7, 0, 28, 56, 84, 112]
+    assert alice['squat'].tolist() == [100, 100, 110, 110, 110, 130]
+    assert timeline[timeline['user_id'] == 2]['squat'].tolist() == [200]
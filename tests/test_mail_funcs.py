@@ -0,0 +1,106 @@
+'''tests for emailing the weekly reports'''
+
+import smtplib
+
+import pandas as pd
+import pytest
+
+from functions import mail_funcs
+from functions.mail_funcs import send_reports
+
+
+class FakeSMTP(object):
+    '''
+    Stands in for `smtplib.SMTP` - `errors` maps an address to the
+    errors raised by its next sends, in turn
+    '''
+    errors = {}
+    sent = []
+
+    def __init__(self, host, port, timeout=None):
+        pass
+
+    def send_message(self, message):
+        errors = self.errors.get(message['To'], [])
+        if len(errors) > 0:
+            raise errors.pop(0)
+        assert message.get_payload()[1].get_filename().endswith('lp-workout.html')
+        self.sent.append(message['To'])
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(FakeSMTP, 'errors', {})
+    monkeypatch.setattr(FakeSMTP, 'sent', [])
+    monkeypatch.setattr(mail_funcs.smtplib, 'SMTP', FakeSMTP)
+    return FakeSMTP
+
+
+@pytest.fixture
+def users(con, seed):
+    '''
+    Three active users with this week's report built - carol
+    has no email address
+    '''
+    for user in ['alice', 'bob', 'carol']:
+        seed(user)
+        with open(f'{user}-lp-workout.html', 'w') as f:
+            f.write(f'<html>{user}</html>')
+    con.execute('UPDATE dim_user SET email = NULL WHERE user_name = "carol"')
+    con.commit()
+
+
+def outcomes(con):
+    df = pd.read_sql('SELECT * FROM email_delivery INNER JOIN dim_user USING (user_id)', con)
+    return {user: (status, attempts) for user, status, attempts in
+            zip(df['user_name'], df['status'], df['attempts'])}
+
+
+def test_reports_are_sent_and_recorded(con, users, smtp):
+    deliveries = send_reports(con, backoff=0)
+    assert sorted(smtp.sent) == ['alice@example.com', 'bob@example.com']
+    assert outcomes(con) == {'alice': ('sent', 1), 'bob': ('sent', 1), 'carol': ('skipped', 0)}
+    assert [d.error for d in deliveries if d.status == 'skipped'] == ['no email address']
+
+    # sent reports are not sent again the same week
+    send_reports(con, backoff=0)
+    assert sorted(smtp.sent) == ['alice@example.com', 'bob@example.com']
+
+
+def test_transient_failures_are_retried(con, users, smtp):
+    smtp.errors['alice@example.com'] = [smtplib.SMTPResponseException(451, b'try again later'),
+                                        smtplib.SMTPServerDisconnected('connection lost')]
+    send_reports(con, backoff=0)
+    assert outcomes(con)['alice'] == ('sent', 3)
+
+
+def test_permanent_failures_are_not_retried(con, users, smtp):
+    smtp.errors['alice@example.com'] = [smtplib.SMTPResponseException(550, b'no such user')] * 2
+    deliveries = send_reports(con, backoff=0)
+    assert outcomes(con)['alice'] == ('failed', 1)
+    assert outcomes(con)['bob'] == ('sent', 1)
+    assert '550' in [d.error for d in deliveries if d.status == 'failed'][0]
+
+
+def test_transient_failures_give_up_after_retries(con, users, smtp):
+    smtp.errors['alice@example.com'] = [smtplib.SMTPResponseException(421, b'busy')] * 5
+    send_reports(con, retries=2, backoff=0)
+    assert outcomes(con)['alice'] == ('failed', 3)
+
+
+def test_outcomes_are_recorded_when_dispatch_is_interrupted(con, users, smtp):
+    smtp.errors['bob@example.com'] = [KeyboardInterrupt()]
+    with pytest.raises(KeyboardInterrupt):
+        send_reports(con, connections=1, backoff=0)
+    assert outcomes(con) == {'alice': ('sent', 1), 'bob': ('pending', 1), 'carol': ('skipped', 0)}
+
+    # the next run only sends what is still unsent
+    send_reports(con, backoff=0)
+    assert smtp.sent == ['alice@example.com', 'bob@example.com']
+    assert outcomes(con)['bob'] == ('sent', 1)
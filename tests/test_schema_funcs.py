@@ -0,0 +1,105 @@
+'''tests for migrating databases made before the schema was versioned'''
+
+import json
+import logging
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from functions.db_funcs import create_db, get_db_con
+from functions.schema_funcs import get_version
+
+baseline_tables = '''
+CREATE TABLE dim_user(user_id INT, user_name STRING, email STRING);
+CREATE TABLE dim_progression(user_id INT, prog_dict JSON);
+CREATE TABLE one_rep_max(user_id INT, data_start_date TIMESTAMP, data_end_date TIMESTAMP, orm_dict JSON, publish_time TIMESTAMP);
+CREATE TABLE accessory(user_id INT, me_name STRING, ae_name STRING, ae_weight FLOAT, sets INT, reps INT, publish_time TIMESTAMP);
+CREATE TABLE pause_workout(user_id INT, pause_date TIMESTAMP DEFAULT '2999-12-31 23:59:59', pause_flag BOOLEAN DEFAULT False);
+'''
+
+start = pd.Timestamp('2026-01-04')
+weights = {'squat': 500, 'bench': 300, 'deadlift': 600, 'ohp': 200}
+
+
+def orm_row(user_id, start, orm_dict, publish_time):
+    return {'user_id': user_id, 'data_start_date': start,
+            'data_end_date': start + pd.Timedelta(days=27),
+            'orm_dict': json.dumps(orm_dict), 'publish_time': pd.Timestamp(publish_time)}
+
+
+@pytest.fixture
+def baseline(db):
+    '''
+    A db written the way the code before the migrations wrote it - the
+    users' pause_workout rows are added with only a user_id, and flags
+    are set to the strings "True" and "False" when a workout is paused
+    or unpaused
+    '''
+    con = sqlite3.connect(db, detect_types=sqlite3.PARSE_DECLTYPES)
+    con.executescript(baseline_tables)
+    users = pd.DataFrame({'user_id': [1, 2, 3], 'user_name': ['alice', 'bob', 'carol'],
+                          'email': ['alice@example.com', 'bob@example.com', None]})
+    users.to_sql('dim_user', con, if_exists='append', index=False)
+    users[['user_id']].to_sql('pause_workout', con, if_exists='append', index=False)
+    con.execute('UPDATE pause_workout SET pause_flag = ? WHERE user_id = ?', ['False', 1])
+    con.execute('UPDATE pause_workout SET pause_flag = ? WHERE user_id = ?', ['True', 3])
+    pd.DataFrame([{'user_id': 1, 'prog_dict': json.dumps({'squat': 5})},
+                  {'user_id': 1, 'prog_dict': json.dumps({'squat': 10})}]).to_sql(
+        'dim_progression', con, if_exists='append', index=False)
+    pd.DataFrame([orm_row(1, start, dict(weights, squat=400), '2026-01-02'),
+                  orm_row(1, start + pd.Timedelta(days=28), weights, '2026-01-30'),
+                  # saved twice - the later one is the month's weights
+                  orm_row(1, start, weights, '2026-01-03'),
+                  orm_row(2, start, {'squat': 'heavy'}, '2026-01-02')]).to_sql(
+        'one_rep_max', con, if_exists='append', index=False)
+    con.commit()
+    yield con
+    con.close()
+
+
+def test_migration_keeps_every_users_rows(db, baseline, caplog):
+    con = get_db_con(db)
+    with caplog.at_level(logging.INFO):
+        create_db(con)
+    assert get_version(con) == 5
+
+    flags = dict(con.execute('SELECT user_id, pause_flag FROM pause_workout'))
+    # bob's flag is the 0 stored by `DEFAULT False`, so he stays inactive
+    assert flags == {1: 'False', 2: '0', 3: 'True'}
+    assert 'user_ids [2]' in caplog.text
+
+    assert con.execute('SELECT prog_dict FROM dim_progression').fetchall() == [('{"squat": 10}',)]
+    orm = pd.read_sql('SELECT * FROM one_rep_max ORDER BY user_id, data_start_date', con)
+    assert orm[['user_id', 'data_start_date']].values.tolist() == [
+        [1, start], [1, start + pd.Timedelta(days=28)], [2, start]]
+    assert json.loads(orm['orm_dict'][0]) == weights
+    assert 'one_rep_max rows share (user_id, data_start_date)' in caplog.text
+
+
+def test_migration_plans_stored_months(db, baseline, caplog):
+    con = get_db_con(db)
+    create_db(con)
+    plan = pd.read_sql('SELECT * FROM workout_plan', con)
+    # bob's month has no usable weights, so only alice's months are planned
+    assert 'could not plan the month of user_id 2' in caplog.text
+    assert plan.groupby(['user_id', 'data_start_date']).size().tolist() == [48, 48]
+    squat = plan[(plan['lift'] == 'squat') & (plan['data_start_date'] == str(start))]
+    squat = squat.set_index(['week', 'set_number'])
+    assert squat.loc[(1, 1), 'weight'] == 325
+    assert squat.loc[(3, 3), ['weight', 'reps']].tolist() == [475, 1]
+    assert squat.loc[(4, 1), 'plates'] == '45, 25, 5, 2.5'
+
+    # planned months are not planned again
+    create_db(con)
+    assert con.execute('SELECT COUNT(*) FROM workout_plan').fetchone()[0] == 96
+
+
+def test_duplicate_users_abort_the_migration(db, baseline):
+    baseline.execute('INSERT INTO dim_user VALUES (4, "alice", "other@example.com")')
+    baseline.commit()
+    con = get_db_con(db)
+    with pytest.raises(ValueError, match='user_name'):
+        create_db(con)
+    assert get_version(con) == 0
+    assert con.execute('SELECT COUNT(*) FROM dim_user').fetchone()[0] == 4
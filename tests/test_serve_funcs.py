@@ -0,0 +1,74 @@
+'''tests for the http workout service'''
+
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+from functions.db_funcs import DBHelper, create_db, get_db_con, table_overwrite
+from functions.dt_funcs import now
+from functions.json_funcs import encode
+from functions.record_funcs import OrmEntry
+from functions.serve_funcs import WorkoutService, make_server
+
+weights = {'squat': 500, 'bench': 300, 'deadlift': 600, 'ohp': 200}
+
+
+@pytest.fixture
+def service(tmp_path):
+    '''
+    A service on a db with one user whose current
+    month is a full four week month
+    '''
+    db = str(tmp_path / 'workout.db')
+    con = get_db_con(db)
+    create_db(con)
+    helper = DBHelper(con, 'alice', 'alice@example.com')
+    today = pd.Timestamp(now())
+    start = today - pd.Timedelta(days=(today.dayofweek + 1) % 7)
+    table_overwrite('one_rep_max', [OrmEntry(helper.user_id, start, start + pd.Timedelta(days=27),
+                                             encode(weights), now(date=False))],
+                    ['user_id', 'data_start_date'], con)
+    service = WorkoutService(db, readers=2)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield helper, f'http://127.0.0.1:{server.server_port}/users/alice/week/current?format=json'
+    server.shutdown()
+    server.server_close()
+    service.close()
+    con.close()
+
+
+def get(url, etag=None):
+    request = urllib.request.Request(url, headers={} if etag is None else {'If-None-Match': etag})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers['ETag'], response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers['ETag'], e.read()
+
+
+def test_unchanged_workout_is_not_modified(service):
+    helper, url = service
+    status, etag, body = get(url)
+    assert status == 200
+    assert json.loads(body)['one_rep_max']['squat'] == 500
+    assert get(url, etag)[0] == 304
+
+
+def test_edit_to_current_month_changes_etag_and_body(service):
+    helper, url = service
+    status, etag, body = get(url)
+    helper.set_one_rep_max(dict(weights, squat=300))
+    status, new_etag, new_body = get(url, etag)
+    assert status == 200
+    assert new_etag != etag
+    workout = json.loads(new_body)
+    assert workout['one_rep_max']['squat'] == 300
+    week = workout['week']
+    mods = {1: .65, 2: .7, 3: .75, 4: .4}
+    assert workout['workout'][0]['squat'] == round(300 * mods[week] / 5) * 5
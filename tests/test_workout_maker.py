@@ -0,0 +1,106 @@
+'''tests for building the workout reports'''
+
+import pandas as pd
+
+from functions.db_funcs import DBHelper, load_context
+
+
+def latest_start(con, user_id):
+    return con.execute('SELECT MAX(data_start_date) FROM one_rep_max WHERE user_id = ?',
+                       [user_id]).fetchone()[0]
+
+
+def test_progression_changes_chart(con, seed, workout_maker):
+    helper = seed('alice', months_ago=3)
+    # as in main, the context is loaded before the user is progressed
+    runner = workout_maker.WorkoutMaker(con, 'alice', context=load_context(con))
+    key = runner.get_orm_chart_key()
+    svg = runner.create_chart_html()
+    runner.run()
+    new_key = runner.get_orm_chart_key()
+    assert new_key != key
+    assert new_key == DBHelper(con, 'alice').get_orm_chart_key()
+    new_svg = runner.get_orm_chart(new_key)
+    assert new_svg != svg
+    latest = latest_start(con, helper.user_id)[:10]
+    assert latest in new_svg
+    with open('alice-lp-workout.html') as f:
+        assert latest in f.read()
+
+
+def rebuilt(con, workout_maker, user='alice'):
+    '''
+    Runs an incremental build on a fresh context, as main does, and
+    checks if the report was written again
+    '''
+    path = f'{user}-lp-workout.html'
+    with open(path, 'w') as f:
+        f.write('last build')
+    runner = workout_maker.WorkoutMaker(con, user, context=load_context(con))
+    runner.run(incremental=True)
+    with open(path) as f:
+        return f.read() != 'last build'
+
+
+def accessory_df(weight):
+    lifts = ['deadlift', 'squat', 'bench', 'ohp']
+    return pd.DataFrame({'me_name': [lift for lift in lifts for _ in range(4)],
+                         'ae_name': [f'{lift} accessory {i}' for lift in lifts for i in range(4)],
+                         'ae_weight': weight, 'sets': 3, 'reps': 10})
+
+
+def test_incremental_build_skips_unchanged_reports(con, seed, workout_maker):
+    helper = seed('alice')
+    helper.set_accessory(accessory_df(50))
+    assert rebuilt(con, workout_maker)
+    assert not rebuilt(con, workout_maker)
+
+    helper.set_one_rep_max({'squat': 510, 'bench': 300, 'deadlift': 600, 'ohp': 200})
+    assert rebuilt(con, workout_maker)
+    assert not rebuilt(con, workout_maker)
+
+    helper.set_accessory(accessory_df(60))
+    assert rebuilt(con, workout_maker)
+    assert not rebuilt(con, workout_maker)
+
+
+def test_template_change_rebuilds_reports(con, seed, workout_maker, monkeypatch):
+    seed('alice')
+    assert rebuilt(con, workout_maker)
+    monkeypatch.setattr(workout_maker, 'template_version', workout_maker.template_version + 1)
+    assert rebuilt(con, workout_maker)
+    assert not rebuilt(con, workout_maker)
+
+
+def test_incremental_build_after_progression(con, seed, workout_maker):
+    seed('alice', months_ago=2)
+    assert rebuilt(con, workout_maker)
+    # the fingerprint stored by the build that progressed the user
+    # must already cover the months it added
+    assert not rebuilt(con, workout_maker)
+
+
+def test_batch_records_each_users_outcome(db, con, seed, workout_maker):
+    seed('alice', months_ago=2)
+    # no one_rep_max, so the worker fails to build the workout
+    DBHelper(con, 'bob', 'bob@example.com')
+    # no progression, so the up front progression fails
+    carol = seed('carol', months_ago=2)
+    con.execute('DELETE FROM dim_progression WHERE user_id = ?', [carol.user_id])
+    con.commit()
+
+    report = workout_maker.run_batch(con, db=db, workers=2, incremental=True)
+    status = dict(zip(report['user_name'], report['status']))
+    assert status == {'alice': 'success', 'bob': 'failed', 'carol': 'failed'}
+    errors = dict(zip(report['user_name'], report['error']))
+    assert errors['alice'] is None or pd.isnull(errors['alice'])
+    assert 'dim_progression is not populated' in errors['carol']
+    assert 'Traceback' in errors['bob']
+
+    with open('alice-lp-workout.html') as f:
+        assert latest_start(con, 1)[:10] in f.read()
+    # the workers' cache writes are applied on the writer connection
+    for table in ['report_fingerprint', 'orm_chart']:
+        users = [row[0] for row in con.execute(f'SELECT user_name FROM {table} '
+                                               'INNER JOIN dim_user USING (user_id)')]
+        assert users == ['alice']
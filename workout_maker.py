@@ -1,19 +1,26 @@
 #! /usr/bin/python
 
-import datetime
+import argparse
+import hashlib
 import os
 import sys
+import traceback
 
 import pandas as pd
 
-from functions.db_funcs import DBHelper, get_db_con, LOCAL_DIR, logger, retrieve_json, table_pull
-from functions.dt_funcs import get_week, get_full_dates, backfill_dates
-from functions.html_funcs import (accessory_html_gen, border_apply, full_html,
-                                  html_wrap, ref_html_gen)
-from functions.workout_funcs import get_workout
-from functions.viz_funcs import format_orm, plot_orm
+from functions.db_funcs import (DBHelper, apply_writes, create_db, get_db_con, LOCAL_DIR,
+                                load_context, read_sql, table_pull)
+from functions.dt_funcs import orm_timeline
+from functions.html_funcs import template_version, write_report
+from functions.log_funcs import (configure_logging, configure_worker_logging, get_logger,
+                                 start_process_logging, subsystems)
+from functions.metrics_funcs import metrics, timed
+from functions.record_funcs import WorkoutSet, records_to_frame
+from functions.plan_funcs import plan_reference_sets, plan_workout_sets
+from functions.viz_funcs import format_orm, orm_svg
 
 con = get_db_con()
+logger = get_logger('report')
 
 
 class WorkoutMaker(DBHelper):
@@ -29,100 +36,141 @@ class WorkoutMaker(DBHelper):
     email: str, optional
         email of username - only needed if user has not yet
         been populated in dim_users
+    context: obj, dict, optional
+        output of functions.db_funcs.load_context
+    defer_writes: bool
+        if True, cache writes are queued in `pending_writes`
+        instead of being written
 
     Notes
     -----
     Inherits database query functions from functions.db_funcs.DBHelper
     '''
 
-    def __init__(self, con, user, email=None):
-        DBHelper.__init__(self, con, user, email)
-        self.workout_df = None
+    def __init__(self, con, user, email=None, context=None, defer_writes=False):
+        DBHelper.__init__(self, con, user, email, context, defer_writes)
+        self.workout_sets = None
+        self.plan = None
 
+    @property
+    def workout_df(self):
+        '''
+        The main workout as a df, for use in the notebook
+        '''
+        if self.workout_sets is None:
+            return None
+        return records_to_frame(self.workout_sets, WorkoutSet)
+
+    @timed()
     def create_workout_df(self):
         '''
-        Runs code to generate the raw df for the 
-        main workout
+        Reads the sets of this week's main
+        workout from the stored plan
         '''
         self.progress_one_rep_max()
-        orm = self.get_orm().reset_index(drop=True)
-        week = get_week(orm)
-        orm_dict = retrieve_json(orm, 'orm_dict')
-        self.workout_df = get_workout(orm_dict, weeks=[week])
+        week = self.get_current_week()
+        self.plan = self.get_plan(week)
+        self.workout_sets = plan_workout_sets(self.plan)
     
-    def create_orm_html(self):
+    def viz_orm(self):
         '''
-        converts orm df to html
+        Returns a visualization of orm progression
         '''
-        orm = pd.DataFrame(retrieve_json(self.get_orm(), 'orm_dict'), index=[0])
-        orm = orm[['deadlift', 'squat', 'bench', 'ohp']]
-        orm_html = html_wrap(orm)
-        return orm_html
+        from functions.viz_funcs import plot_orm
 
-    def create_workout_html(self):
-        '''
-        Converts the workout df to html
-        '''
-        workout_html = html_wrap(self.workout_df)
-        return workout_html
+        orm = table_pull(self.con, self.user_id, 'one_rep_max')
+        orm = format_orm(orm)
+        orm['user_id'] = self.user_id
+        plot_orm(orm_timeline(orm))
 
-    def create_reference_html(self):
+    @timed()
+    def create_chart_html(self):
         '''
-        Generates the raw df to calculate reference
-        weights from the main workout df and formats
-        it to html
+        Gets the orm progression chart as inline svg - only
+        re-rendered when a one_rep_max row has been added
         '''
-        ref_html = ref_html_gen(self.workout_df)
-        return ref_html
+        key = self.get_orm_chart_key()
+        svg = self.get_orm_chart(key)
+        if svg is None:
+            orm = format_orm(table_pull(self.con, self.user_id, 'one_rep_max'))
+            orm['user_id'] = self.user_id
+            svg = orm_svg(orm_timeline(orm))
+            self.set_orm_chart(key, svg)
+        return svg
 
-    def create_accessory_html(self):
-        '''
-        Pulls the accessory workout df from the database
-        and formats it to html
+    @timed()
+    def get_report_fingerprint(self):
         '''
-        acc = self.get_accessory()
-        acc_html = accessory_html_gen(acc)
-        return acc_html
+        Hashes everything the report depends on - the current
+        one_rep_max row, the week, the one_rep_max history, the latest
+        accessory publish_time and the template version
 
-    def get_week_vals(self):
+        Returns
+        -------
+        fingerprint: str
         '''
-        Gets the current week information based on the
-        `one_rep_max` pulled from the database
-        '''
-        orm = self.get_orm().reset_index(drop=True)
-        week = get_week(orm)
-        start = orm['data_start_date'][0] + datetime.timedelta(days=(week-1)*7)
-        end = start + datetime.timedelta(days=7)
-        return week, start.date(), end.date()
+        orm = self.get_orm_entry()
+        inputs = [orm.data_start_date, orm.data_end_date,
+                  orm.orm_dict, self.get_current_week(), self.get_orm_chart_key(),
+                  self.get_accessory_publish_time(), template_version]
+        return hashlib.sha256('|'.join(map(str, inputs)).encode()).hexdigest()
 
-    def viz_orm(self):
+    @timed()
+    def save_report(self, path, chart_html=''):
         '''
-        Returns a visualization of orm progression
+        Streams the report html to `path`
+
+        Parameters
+        ----------
+        path: str
+        chart_html: str
+            from `create_chart_html`
+
+        Notes
+        -----
+        Written next to `path` and swapped in, so a failed render never
+        leaves a truncated report in place of the last good one
         '''
-        orm = table_pull(self.con, self.user_id, 'one_rep_max')
-        orm = format_orm(orm)
-        full_dt = get_full_dates(orm)
-        backfilled = backfill_dates(orm, full_dt)
-        plot_orm(orm)
+        orm = [self.get_orm_entry().weights]
+        accessory = self.get_accessory_lifts()
+        week, start, end = self.get_week_vals()
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                write_report(f, orm, self.workout_sets, accessory, week, start, end,
+                             chart_html=chart_html, reference=plan_reference_sets(self.plan))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
-    def run(self, file='lp-workout.html'):
+    @timed()
+    def run(self, file='lp-workout.html', incremental=False):
         '''
         Runs all relevant funcions and saves the final
         html output to `path`
+
+        Parameters
+        ----------
+        file: str
+            file name, prefixed with the user name
+        incremental: bool
+            if True, skips rendering and writing when the report
+            fingerprint matches the one stored for the last build
         '''
         self.create_workout_df()
-        orm_html = self.create_orm_html()
-        workout_html = self.create_workout_html()
-        ref_html = self.create_reference_html()
-        accessory_html = self.create_accessory_html()
-        week, start, end = self.get_week_vals()
-        html = full_html(orm_html, workout_html, ref_html,
-                         accessory_html, week, start, end)
         fname = f'{self.user}-{file}'
         path = os.path.join(LOCAL_DIR, fname)
-        with open(path, 'w') as f:
-            f.write(html)
-            logger.info(f'workout saved to {path}')
+        if incremental == True:
+            fingerprint = self.get_report_fingerprint()
+            if fingerprint == self.get_fingerprint(file) and os.path.isfile(path):
+                logger.info(f'workout unchanged - skipped {path}')
+                return
+        self.save_report(path, self.create_chart_html())
+        logger.info(f'workout saved to {path}')
+        if incremental == True:
+            self.set_fingerprint(file, fingerprint)
 
 
 def get_kwargs(con, dim_user, index):
@@ -170,12 +218,150 @@ def get_iterable_kwargs(con):
     dim_user b
     USING (user_id)
     '''
-    dim_user = pd.read_sql(s, con)
+    dim_user = read_sql(s, con)
     kwarg_iter = [get_kwargs(con, dim_user, i) for i in dim_user.index]
     return kwarg_iter
 
 
-def main(con):
+_worker_con = None
+_worker_context = None
+
+
+def init_worker(db, log_queue=None, levels=None):
+    '''
+    Process pool initializer - opens the read connection
+    used by every job that runs in this worker and bulk loads
+    the user context on it
+
+    Parameters
+    ----------
+    db: str
+        sqlite database name
+    log_queue: obj, multiprocessing.Queue, optional
+        log records are sent through it to the parent's log
+    levels: obj, dict, optional
+        logger levels of the parent
+    '''
+    global _worker_con, _worker_context
+    if log_queue is not None:
+        configure_worker_logging(log_queue, levels)
+    _worker_con = get_db_con(db=db)
+    _worker_context = load_context(_worker_con)
+
+
+def run_worker(user, email, incremental=False):
+    '''
+    Builds and saves the workout for one user on the
+    worker's own connection
+
+    Parameters
+    ----------
+    user: str
+    email: str
+    incremental: bool
+        see `WorkoutMaker.run`
+
+    Returns
+    -------
+    user: str
+    error: str
+        formatted traceback, None if the run succeeded
+    writes: list of tuple
+        cache writes for the writer connection to apply
+    record: obj, dict
+        the user's metrics record, for the parent to merge
+    '''
+    writes = []
+    error = None
+    with metrics.user_scope(user, _worker_con):
+        try:
+            runner = WorkoutMaker(_worker_con, user, email, context=_worker_context,
+                                  defer_writes=True)
+            runner.run(incremental=incremental)
+            writes = runner.pending_writes
+        except Exception:
+            error = traceback.format_exc()
+    return user, error, writes, metrics.users.pop(user)
+
+
+def run_batch(con, db='workout.db', workers=None, incremental=False):
+    '''
+    Builds workouts for all active users across a process pool
+
+    Parameters
+    ----------
+    con: sqlite3.Connection
+        writer connection - all database writes go through it
+    db: str
+        sqlite database name each worker opens its
+        read connection to
+    workers: int, optional
+        size of the process pool - defaults to the cpu count
+    incremental: bool
+        if True, reports whose inputs are unchanged are skipped
+
+    Returns
+    -------
+    report: obj, pandas df
+        one row per user with the `status` of the run and
+        the `error` traceback for failed users
+
+    Notes
+    -----
+    * `progress_one_rep_max` is the only write made during a run, so it
+    is run for every user up front on `con` before the pool is started.
+    The workers then only read from the database and write html files -
+    cache writes (report fingerprints, charts) are sent back and applied on `con`
+    * A failure for one user is logged and recorded in the report
+    instead of aborting the run
+    * Workers send their log records to a listener in this process,
+    so the whole batch shares one log
+    '''
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    kwarg_iter = get_iterable_kwargs(con)
+    context = load_context(con)
+    errors = {}
+    for kwargs in kwarg_iter:
+        with metrics.user_scope(kwargs['user'], con):
+            try:
+                DBHelper(**kwargs, context=context).progress_one_rep_max()
+            except Exception:
+                errors[kwargs['user']] = traceback.format_exc()
+
+    pending = [kwargs for kwargs in kwarg_iter if kwargs['user'] not in errors]
+    log_queue, listener = start_process_logging()
+    levels = {name: get_logger(name).level for name in [None] + subsystems}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(db, log_queue, levels)) as pool:
+            futures = [pool.submit(run_worker, kwargs['user'], kwargs['email'], incremental)
+                       for kwargs in pending]
+            writes = []
+            for future in as_completed(futures):
+                user, error, pending_writes, record = future.result()
+                if error is not None:
+                    errors[user] = error
+                writes += pending_writes
+                metrics.merge(record)
+    finally:
+        listener.stop()
+    # deferred writes are not made on behalf of one user
+    with metrics.user_scope(None, con):
+        apply_writes(con, writes)
+
+    for user, error in errors.items():
+        logger.error('workout failed for %s\n%s', user, error)
+    report = pd.DataFrame({'user_name': [kwargs['user'] for kwargs in kwarg_iter]})
+    report['error'] = report['user_name'].map(errors)
+    report['status'] = report['error'].isnull().map({True: 'success', False: 'failed'})
+    logger.info('batch finished - %s succeeded, %s failed',
+                len(kwarg_iter) - len(errors), len(errors))
+    return report[['user_name', 'status', 'error']]
+
+
+def main(con, workers=None, db='workout.db', incremental=False, metrics_file=None,
+         email=False, smtp=None):
     '''
     Retrieves all user info from dim_user and passes
     them into the WorkoutMaker class as kwargs
@@ -183,18 +369,70 @@ def main(con):
     Parameters
     ----------
     con: sqlite3.Connection
+    workers: int, optional
+        if set, users are spread across a process pool of
+        this size - see `run_batch`
+    db: str
+        sqlite database name - only used by the process pool
+    incremental: bool
+        if True, reports whose inputs are unchanged are skipped
+    metrics_file: str, optional
+        json lines file the per-user metrics and the run
+        summary are appended to
+    email: bool
+        if True, the reports are emailed once they are all
+        built - see `functions.mail_funcs.send_reports`
+    smtp: obj, dict, optional
+        kwargs for `send_reports` - defaults to `smtp_settings()`
 
     Returns
     -------
     WorkoutMaker
         job runner instance
+    report: obj, pandas df
+        if `workers` is set, the per-user report from `run_batch`
     '''
+    metrics.reset()
+    create_db(con)
+    if workers is not None:
+        report = run_batch(con, db=db, workers=workers, incremental=incremental)
+        if email == True:
+            from functions.mail_funcs import send_reports, smtp_settings
+
+            built = report.loc[report['status'] == 'success', 'user_name'].tolist()
+            send_reports(con, users=built, **(smtp or smtp_settings()))
+        metrics.log_summary(metrics_file)
+        return report
     kwarg_iter = get_iterable_kwargs(con)
+    context = load_context(con)
     for kwargs in kwarg_iter:
-        runner = WorkoutMaker(**kwargs)
-        runner.run()
+        with metrics.user_scope(kwargs['user'], con):
+            runner = WorkoutMaker(**kwargs, context=context)
+            runner.run(incremental=incremental)
+    if email == True:
+        from functions.mail_funcs import send_reports, smtp_settings
+
+        send_reports(con, **(smtp or smtp_settings()))
+    metrics.log_summary(metrics_file)
     return runner
 
 
 if __name__ == '__main__':
-    main(con)
+    parser = argparse.ArgumentParser(description='Generates the weekly workout html')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='run users across a process pool of this size')
+    parser.add_argument('--incremental', action='store_true',
+                        help='skip reports whose inputs have not changed')
+    parser.add_argument('--metrics', default=None,
+                        help='append per-user metrics and the run summary to this json lines file')
+    parser.add_argument('--email', action='store_true',
+                        help='email the reports - smtp settings are read from '
+                        'the WORKOUT_SMTP_* environment variables')
+    parser.add_argument('--log-levels', default=None,
+                        help='logger levels, e.g. "INFO,db=WARNING" - subsystems are '
+                        + ', '.join(subsystems))
+    args = parser.parse_args()
+    if args.log_levels is not None:
+        configure_logging(levels=args.log_levels)
+    main(con, workers=args.workers, incremental=args.incremental, metrics_file=args.metrics,
+         email=args.email)